@@ -0,0 +1,83 @@
+"""
+LightRental change notification module.
+
+InventoryDB publishes a ChangeEvent on a ChangeBus after each
+successful write, so that models can update just the affected rows
+instead of re-selecting whole tables. Writes made by other processes
+(another counter, the CLI) are detected by DataVersionWatcher, which
+polls SQLite's per-connection PRAGMA data_version and, when it has
+changed, reads the rows changed meanwhile from the change_log table
+that triggers fill. Those are published as ChangeEvents too, so
+other counters' writes cost a row update, not a reload.
+
+The log also holds this process' own writes, which may thus be
+published twice; handlers must be idempotent.
+"""
+
+from collections import namedtuple
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+ChangeEvent = namedtuple(
+    "ChangeEvent",
+    ['table', 'key', 'op'] # key is the row's primary key value
+)
+
+class ChangeBus(QObject):
+    """Broadcasts row-level changes of one database."""
+    changed = pyqtSignal(object) # ChangeEvent, made by any connection
+    external_change = pyqtSignal() # too many external changes to follow row by row: reload
+
+    def publish(self, table, key, op=INSERT):
+        self.changed.emit(ChangeEvent(table, key, op))
+
+class DataVersionWatcher(QObject):
+    """Polls PRAGMA data_version and publishes the rows other connections changed.
+
+    data_version only changes when a *different* connection commits,
+    so change_log is only read then. Commits that change nothing views
+    show (archiving, invoicing, statistics) publish nothing. If more
+    than max_events rows changed, or the log has been pruned past the
+    last entry seen, external_change asks views to reload instead.
+    """
+    def __init__(self, db, bus, interval_ms=1000, parent=None, max_events=500) -> None:
+        """Start polling.
+
+        :param db: database to watch
+        :type db: InventoryDB
+        :param bus: where external changes are announced
+        :type bus: ChangeBus
+        :param interval_ms: polling period
+        :type interval_ms: int
+        :param max_events: most changes published one by one per poll
+        :type max_events: int
+        """
+        super().__init__(parent)
+        self.db = db
+        self.bus = bus
+        self.max_events = max_events
+        self.version = db.data_version()
+        self.last_change = db.last_id(db.md.change_log.table)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(interval_ms)
+    def poll(self):
+        version = self.db.data_version()
+        if version == self.version:
+            return
+        self.version = version
+        changes = self.db.changes(self.last_change)
+        if not changes:
+            return
+        # log ids are consecutive; a gap means entries were pruned unseen
+        if changes[0][0] > self.last_change + 1 or len(changes) > self.max_events:
+            self.bus.external_change.emit()
+        else:
+            for _id, table, key, op in changes:
+                self.bus.publish(table, key, op)
+        self.last_change = changes[-1][0]
+    def stop(self):
+        self.timer.stop()
@@ -1,27 +1,50 @@
 """
 LightRental database module.
 
-All the SQL code is contained here. Other parts of
-the program need not execute SQL queries - they call
+All the SQL code the counters run is contained here. Other
+parts of the program need not execute SQL queries - they call
 methods of a class provided here. Moreover, they
 shouldn't, as otherwise they can mess up the
 checkin/checkout history.
 
+The exception are the administrative passes - integrity checks
+and repair, billing, maintenance and snapshot export. Each is one
+or a few set-based statements that only make sense together (temp
+tables, PRAGMAs, ATTACH), so their modules run their own SQL on an
+InventoryDB's connection rather than bloating InventoryDB with
+single-use methods. They never update or delete history themselves:
+the deletion triggers generated here still guard it, and archiving
+may only delete what archive_log records as moved.
+
 Includes Item, SKU, Customer, Category, Checkin, Checkout
 dataclasses that each represent a record from the namesake table. 
 Their member fields can hold corresponding SQL DB
 column names, indices and relations (note that pretty much all
 SQL metadata is column-related - it's a relational DB, after all)
 and the actual data. 
+
+db_metadata, built of those dataclasses, is the single description
+of the schema: table DDL, indexes, deletion triggers, the prepared
+INSERT/SELECT statements and the models' QSqlRelations are all
+generated from it.
+
+Old checkin/checkout records may be moved to an archive file next to
+the database (see the maintenance module). The archive is created,
+empty, along with the database (or by ensure_schema for older files),
+so every connection has it attached read-only from the start and
+sees records as soon as they are moved. History is read through the
+temporary views checkin_history and checkout_history, which span
+both files.
 """
 
-import collections
 from PyQt5.QtSql import (
     QSqlQuery, 
     QSqlDatabase,
     QSqlRelation
 )
 from os import path
+from urllib.parse import quote
+from datetime import datetime
 from dataclasses import dataclass
 from typing import Union
 
@@ -30,126 +53,666 @@ class Relation:
     table: str # where 'index' and 'col' are
     index: str # foreign key index
     col: str # what's shown instead of index
+    def qt_relation(self) -> QSqlRelation:
+        return QSqlRelation(self.table, self.index, self.col)
+    def foreign_key_sql(self, column) -> str:
+        return (f"FOREIGN KEY ({column}) REFERENCES {self.table} ({self.index})"
+                " ON DELETE RESTRICT ON UPDATE CASCADE")
 
 @dataclass
 class Column:
     name: str
     index: int
-    sql_type: str 
+    sql_type: str = 'INTEGER'
     sql_col_constraint: str = ''
     relation: Relation = None
+    indexed: bool = False # gets a '<table>_<name>' index
+    index_extra: tuple = () # further columns of that index
+    def sql(self) -> str:
+        return f"{self.name} {self.sql_type} {self.sql_col_constraint}".rstrip()
+
+class Table:
+    """DDL and statement generation shared by the table dataclasses.
+
+    Columns are the Column-valued fields; the first one is the primary key.
+    """
+    archivable = False # rows may be moved to the archive file
+    immutable = False # rows can't be updated either, only inserted
+    def columns(self):
+        cols = [v for v in vars(self).values() if isinstance(v, Column)]
+        return sorted(cols, key=lambda c: c.index)
+    def key(self) -> Column:
+        return self.columns()[0]
+    def column(self, name) -> Column:
+        for col in self.columns():
+            if col.name == name:
+                return col
+        raise KeyError(f"{self.table} has no column {name}")
+    def create_sql(self, schema='') -> str:
+        """
+        :param schema: attached database to create the table in; there,
+        foreign keys are left out as the parent tables aren't alongside
+        :type schema: str, optional
+        """
+        cols = self.columns()
+        defs = [c.sql() for c in cols]
+        if not schema:
+            defs += [c.relation.foreign_key_sql(c.name) for c in cols if c.relation is not None]
+        return f"CREATE TABLE IF NOT EXISTS {_qualified(schema, self.table)} ({', '.join(defs)})"
+    def index_sql(self, schema=''):
+        return [
+            f"CREATE INDEX IF NOT EXISTS {_qualified(schema, f'{self.table}_{c.name}')} "
+            f"ON {self.table} ({', '.join((c.name,) + tuple(c.index_extra))})"
+            for c in self.columns() if c.indexed
+        ]
+    def trigger_sql(self, schema=''):
+        """Deletion guard of an append-only table, and update guard
+        of an immutable one.
+
+        In the main file, rows of archivable tables become deletable
+        once an archive_log entry records them as moved to the archive;
+        in an attached archive (schema given) nothing is. The update
+        guard leaves out foreign key columns in the main file, so that
+        renaming a parent key still cascades.
+        """
+        if not self.append_only:
+            return []
+        statements = []
+        if self.immutable:
+            guarded = [c.name for c in self.columns() if schema or c.relation is None]
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {_qualified(schema, f'{self.table}_prevent_update')} "
+                f"BEFORE UPDATE OF {', '.join(guarded)} ON {self.table} "
+                "BEGIN "
+                f"SELECT RAISE(ABORT, '{self.table} records cannot be changed'); "
+                "END"
+            )
+        when = ''
+        if self.archivable and not schema:
+            when = (
+                f"WHEN OLD.{self.key().name} > (SELECT COALESCE(MAX(last_id), 0) "
+                f"FROM archive_log WHERE table_name = '{self.table}') "
+            )
+        return statements + [
+            f"CREATE TRIGGER IF NOT EXISTS {_qualified(schema, f'{self.table}_prevent_deletion')} "
+            f"BEFORE DELETE ON {self.table} "
+            f"{when}"
+            "BEGIN "
+            f"SELECT RAISE(ABORT, '{self.table} records cannot be deleted'); "
+            "END"
+        ]
+    def insert_sql(self) -> str:
+        names = [c.name for c in self.columns()]
+        return (f"INSERT INTO {self.table} ({', '.join(names)}) "
+                f"VALUES ({', '.join(':' + n for n in names)})")
+    def select_sql(self) -> str:
+        """Select a row by primary key, bound to ':key'."""
+        names = [c.name for c in self.columns()]
+        return f"SELECT {', '.join(names)} FROM {self.table} WHERE {self.key().name} = :key"
+    def relations(self):
+        """(column index, QSqlRelation) pairs for QSqlRelationalTableModel.setRelation."""
+        return [(c.index, c.relation.qt_relation()) for c in self.columns() if c.relation is not None]
+
+def _qualified(schema, name):
+    return f"{schema}.{name}" if schema else name
 
 @dataclass
-class Item:
+class Item(Table):
     table: str
     inv_nr: Union[int, Column]
     SKU: Union[int, Column]
     category_id: Union[int, Column]
     img_path: Union[str, Column]
     notes: Union[str, Column]
+    append_only: bool = False
 
 @dataclass
-class SKU:
+class SKU(Table):
     table: str
     SKU: Union[int, Column]
     name: Union[str, Column]
     notes: Union[str, Column]
+    append_only: bool = False
 
 @dataclass
-class Customer:
+class Category(Table):
+    table: str
+    id: Union[int, Column]
+    name: Union[str, Column]
+    notes: Union[str, Column]
+    append_only: bool = False
+
+@dataclass
+class Customer(Table):
     table: str
     id: Union[int, Column]
     name: Union[str, Column]
     contacts: Union[str, Column]
     notes: Union[str, Column]
+    append_only: bool = False
 
 @dataclass
-class CheckInOut:
+class CheckInOut(Table):
     table: str
     id: Union[int, Column]
     time: Union[str, Column]
+    customer_id: Union[int, Column]
     inv_nr: Union[int, Column]
+    due: Union[str, Column] = None # checkouts only
+    append_only: bool = False
+    immutable: bool = False
+    archivable: bool = False
+
+@dataclass
+class ItemOut(Table):
+    table: str
+    inv_nr: Union[int, Column]
+    customer_id: Union[int, Column]
+    checkout_id: Union[int, Column]
+    time: Union[str, Column]
+    due: Union[str, Column]
+    append_only: bool = False
+
+@dataclass
+class CustomerSummary(Table):
+    table: str
+    customer_id: Union[int, Column]
+    items_out: Union[int, Column]
+    lifetime_rentals: Union[int, Column]
+    append_only: bool = False
+
+@dataclass
+class SKURate(Table):
+    table: str
+    SKU: Union[int, Column]
+    day_rate: Union[float, Column]
+    weekend_discount: Union[float, Column] # fraction off weekend days
+    weekly_discount: Union[float, Column] # fraction off days within full weeks
+    append_only: bool = False
+
+@dataclass
+class CustomerRate(Table):
+    table: str
+    customer_id: Union[int, Column]
+    factor: Union[float, Column] # multiplies the SKU price
+    append_only: bool = False
+
+@dataclass
+class Invoice(Table):
+    table: str
+    id: Union[int, Column]
     customer_id: Union[int, Column]
+    period_start: Union[str, Column]
+    period_end: Union[str, Column]
+    created: Union[str, Column]
+    total: Union[float, Column]
+    append_only: bool = False
+    immutable: bool = False
+
+@dataclass
+class InvoiceLine(Table):
+    table: str
+    id: Union[int, Column]
+    invoice_id: Union[int, Column]
+    checkout_id: Union[int, Column]
+    inv_nr: Union[int, Column]
+    start_time: Union[str, Column]
+    end_time: Union[str, Column]
+    days: Union[int, Column]
+    amount: Union[float, Column]
+    append_only: bool = False
+    immutable: bool = False
+
+@dataclass
+class ArchiveLog(Table):
+    table: str
+    id: Union[int, Column]
+    time: Union[str, Column]
+    table_name: Union[str, Column]
+    first_id: Union[int, Column]
+    last_id: Union[int, Column]
+    rows: Union[int, Column]
+    archive: Union[str, Column]
+    append_only: bool = False
+    immutable: bool = False
+
+@dataclass
+class ChangeLog(Table):
+    table: str
+    id: Union[int, Column]
+    table_name: Union[str, Column]
+    row_key: Union[int, Column]
+    op: Union[str, Column]
+    append_only: bool = False
 
 @dataclass 
 class InventoryMetadata:
     items: Item
     SKUs: SKU
+    categories: Category
     customers: Customer
     checkins: CheckInOut
     checkouts: CheckInOut
+    items_out: ItemOut
+    customer_summaries: CustomerSummary
+    SKU_rates: SKURate
+    customer_rates: CustomerRate
+    invoices: Invoice
+    invoice_lines: InvoiceLine
+    archive_log: ArchiveLog
+    change_log: ChangeLog
+    def tables(self):
+        return [v for v in vars(self).values() if isinstance(v, Table)]
+    def table(self, name) -> Table:
+        for table in self.tables():
+            if table.table == name:
+                return table
+        raise KeyError(f"no table {name}")
+
+SKU_RELATION = Relation("skus", "sku", "name")
+CATEGORY_RELATION = Relation("categories", "id", "name")
+ITEM_RELATION = Relation("inventory", "inv_nr", "notes")
+CUSTOMER_RELATION = Relation("customers", "id", "name")
 
 db_metadata = InventoryMetadata(
     items=Item(
         table='inventory',
-        inv_nr=Column('inv_nr', 0),
-        SKU=Column('sku', 1, Relation("skus", "sku", "name")),
-        category_id=Column('category', 2, Relation("categories", "id", "name")),
-        img_path=Column('img_path', 3)
+        inv_nr=Column('inv_nr', 0, sql_col_constraint='PRIMARY KEY ON CONFLICT ROLLBACK'),
+        SKU=Column('sku', 1, sql_col_constraint='NOT NULL', relation=SKU_RELATION, indexed=True),
+        category_id=Column('category', 2, sql_col_constraint='NOT NULL', relation=CATEGORY_RELATION),
+        img_path=Column('img_path', 3, 'TEXT'),
+        notes=Column('notes', 4, 'TEXT')
     ),
     SKUs=SKU(
         table='skus',
-        SKU=Column('sku', 0),
-        name=Column('name', 1),
-        notes=Column('notes', 2)
+        SKU=Column('sku', 0, sql_col_constraint='PRIMARY KEY'),
+        name=Column('name', 1, 'TEXT', 'NOT NULL'),
+        notes=Column('notes', 2, 'TEXT')
+    ),
+    categories=Category(
+        table='categories',
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY'),
+        name=Column('name', 1, 'TEXT', 'NOT NULL'),
+        notes=Column('notes', 2, 'TEXT')
     ),
     customers=Customer(
         table='customers',
-        id=Column('id', 0),
-        name=Column('name', 1),
-        contacts=Column('contacts', 2),
-        notes=Column('notes', 3)
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        name=Column('name', 1, 'TEXT', 'NOT NULL'),
+        contacts=Column('contacts', 2, 'TEXT', 'NOT NULL'),
+        notes=Column('notes', 3, 'TEXT'),
+        append_only=True
     ),
     checkins=CheckInOut(
         table='checkin',
-        id=Column('id', 0),
-        time=Column('time', 1),
-        inv_nr=Column('inv_nr', 1, Relation("inventory", 'inv_nr', 'notes')),
-        customer_id=Column('customer_id', 2)
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        time=Column('time', 1, 'TEXT', 'NOT NULL', indexed=True), # billing periods
+        customer_id=Column('customer_id', 2, sql_col_constraint='NOT NULL', relation=CUSTOMER_RELATION),
+        inv_nr=Column('inv_nr', 3, sql_col_constraint='NOT NULL', relation=ITEM_RELATION,
+            indexed=True, index_extra=('time',)),
+        append_only=True,
+        immutable=True,
+        archivable=True
     ),
     checkouts=CheckInOut(
         table='checkout',
-        id=Column('id', 0),
-        name=Column('name', 1),
-        customer_id=Column('customer_id', 2)
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        time=Column('time', 1, 'TEXT', 'NOT NULL'),
+        customer_id=Column('customer_id', 2, sql_col_constraint='NOT NULL', relation=CUSTOMER_RELATION),
+        inv_nr=Column('inv_nr', 3, sql_col_constraint='NOT NULL', relation=ITEM_RELATION,
+            indexed=True, index_extra=('time',)),
+        due=Column('due', 4, 'TEXT'),
+        append_only=True,
+        immutable=True,
+        archivable=True
+    ),
+    items_out=ItemOut(
+        table='items_out',
+        inv_nr=Column('inv_nr', 0, sql_col_constraint='PRIMARY KEY', relation=ITEM_RELATION),
+        customer_id=Column('customer_id', 1, sql_col_constraint='NOT NULL', relation=CUSTOMER_RELATION,
+            indexed=True, index_extra=('due',)),
+        checkout_id=Column('checkout_id', 2, sql_col_constraint='NOT NULL'),
+        time=Column('time', 3, 'TEXT', 'NOT NULL'),
+        due=Column('due', 4, 'TEXT')
+    ),
+    customer_summaries=CustomerSummary(
+        table='customer_summary',
+        customer_id=Column('customer_id', 0, sql_col_constraint='PRIMARY KEY', relation=CUSTOMER_RELATION),
+        items_out=Column('items_out', 1, sql_col_constraint='NOT NULL DEFAULT 0'),
+        lifetime_rentals=Column('lifetime_rentals', 2, sql_col_constraint='NOT NULL DEFAULT 0')
+    ),
+    SKU_rates=SKURate(
+        table='sku_rates',
+        SKU=Column('sku', 0, sql_col_constraint='PRIMARY KEY', relation=SKU_RELATION),
+        day_rate=Column('day_rate', 1, 'REAL', 'NOT NULL'),
+        weekend_discount=Column('weekend_discount', 2, 'REAL', 'NOT NULL DEFAULT 0'),
+        weekly_discount=Column('weekly_discount', 3, 'REAL', 'NOT NULL DEFAULT 0')
+    ),
+    customer_rates=CustomerRate(
+        table='customer_rates',
+        customer_id=Column('customer_id', 0, sql_col_constraint='PRIMARY KEY', relation=CUSTOMER_RELATION),
+        factor=Column('factor', 1, 'REAL', 'NOT NULL DEFAULT 1')
+    ),
+    invoices=Invoice(
+        table='invoices',
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        customer_id=Column('customer_id', 1, sql_col_constraint='NOT NULL', relation=CUSTOMER_RELATION,
+            indexed=True, index_extra=('period_start',)),
+        period_start=Column('period_start', 2, 'TEXT', 'NOT NULL'),
+        period_end=Column('period_end', 3, 'TEXT', 'NOT NULL'),
+        created=Column('created', 4, 'TEXT', 'NOT NULL'),
+        total=Column('total', 5, 'REAL', 'NOT NULL'),
+        append_only=True,
+        immutable=True
+    ),
+    invoice_lines=InvoiceLine(
+        table='invoice_lines',
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        invoice_id=Column('invoice_id', 1, sql_col_constraint='NOT NULL',
+            relation=Relation("invoices", "id", "period_start"), indexed=True),
+        # UNIQUE: a rental is billed once, even if a period is billed again.
+        # No foreign key: the checkout may have been moved to the archive.
+        checkout_id=Column('checkout_id', 2, sql_col_constraint='NOT NULL UNIQUE'),
+        inv_nr=Column('inv_nr', 3, sql_col_constraint='NOT NULL', relation=ITEM_RELATION),
+        start_time=Column('start_time', 4, 'TEXT', 'NOT NULL'),
+        end_time=Column('end_time', 5, 'TEXT', 'NOT NULL'),
+        days=Column('days', 6, sql_col_constraint='NOT NULL'),
+        amount=Column('amount', 7, 'REAL', 'NOT NULL'),
+        append_only=True,
+        immutable=True
+    ),
+    archive_log=ArchiveLog(
+        table='archive_log',
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        time=Column('time', 1, 'TEXT', 'NOT NULL'),
+        table_name=Column('table_name', 2, 'TEXT', 'NOT NULL', indexed=True, index_extra=('last_id',)),
+        first_id=Column('first_id', 3, sql_col_constraint='NOT NULL'),
+        last_id=Column('last_id', 4, sql_col_constraint='NOT NULL'), # rows up to it are archived
+        rows=Column('rows', 5, sql_col_constraint='NOT NULL'),
+        archive=Column('archive', 6, 'TEXT', 'NOT NULL'), # file name
+        append_only=True,
+        immutable=True
+    ),
+    change_log=ChangeLog(
+        table='change_log',
+        id=Column('id', 0, sql_col_constraint='PRIMARY KEY AUTOINCREMENT'),
+        table_name=Column('table_name', 1, 'TEXT', 'NOT NULL'),
+        row_key=Column('row_key', 2, sql_col_constraint='NOT NULL'), # primary key of the changed row
+        op=Column('op', 3, 'TEXT', 'NOT NULL') # 'insert', 'update' or 'delete'
     )
 )
 
+CHANGE_LOG_SIZE = 10000 # most recent changes kept in change_log
+
+def change_log_sql(md: InventoryMetadata = db_metadata):
+    """Triggers recording every write other counters' views care about in change_log.
+
+    The log is a ring buffer of the last CHANGE_LOG_SIZE changes;
+    DataVersionWatcher reads it to tell which rows another connection
+    has changed. History is append-only, so only its inserts are logged.
+
+    :rtype: list of str
+    """
+    log = md.change_log.table
+    watched = [(t, ('INSERT', 'UPDATE', 'DELETE')) for t in (md.items, md.SKUs, md.categories, md.customers)]
+    watched += [(t, ('INSERT',)) for t in (md.checkins, md.checkouts)]
+    statements = []
+    for table, ops in watched:
+        key = table.key().name
+        for op in ops:
+            row = 'OLD' if op == 'DELETE' else 'NEW'
+            moved = ''
+            if op == 'UPDATE':
+                # a changed key reads as the old row gone
+                moved = (f"INSERT INTO {log} (table_name, row_key, op) SELECT '{table.table}', OLD.{key}, 'delete' "
+                         f"WHERE OLD.{key} IS NOT NEW.{key}; ")
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table.table}_log_{op.lower()} "
+                f"AFTER {op} ON {table.table} "
+                "BEGIN "
+                f"{moved}"
+                f"INSERT INTO {log} (table_name, row_key, op) VALUES ('{table.table}', {row}.{key}, '{op.lower()}'); "
+                "END"
+            )
+    statements.append(
+        f"CREATE TRIGGER IF NOT EXISTS {log}_prune "
+        f"AFTER INSERT ON {log} "
+        "BEGIN "
+        f"DELETE FROM {log} WHERE {md.change_log.id.name} <= NEW.{md.change_log.id.name} - {CHANGE_LOG_SIZE}; "
+        "END"
+    )
+    return statements
+
+def archive_log_sql(md: InventoryMetadata = db_metadata):
+    """Triggers admitting only archive_log entries that match the history.
+
+    The deletion guards trust archive_log, so an entry must continue
+    its table's logged range, stay within the existing ids and count
+    exactly the records it covers - as archiving logs a chunk right
+    before deleting it.
+
+    :rtype: list of str
+    """
+    log = md.archive_log
+    statements = []
+    for table in md.tables():
+        if not table.archivable:
+            continue
+        key = table.key().name
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS {log.table}_check_{table.table} "
+            f"BEFORE INSERT ON {log.table} "
+            f"WHEN NEW.{log.table_name.name} = '{table.table}' AND ("
+            f"NEW.{log.first_id.name} IS NOT (SELECT COALESCE(MAX({log.last_id.name}), 0) + 1 "
+            f"FROM {log.table} WHERE {log.table_name.name} = '{table.table}') "
+            f"OR NEW.{log.last_id.name} < NEW.{log.first_id.name} "
+            f"OR NEW.{log.last_id.name} > (SELECT COALESCE(MAX({key}), 0) FROM {table.table}) "
+            f"OR NEW.{log.rows.name} IS NOT (SELECT COUNT(*) FROM {table.table} "
+            f"WHERE {key} BETWEEN NEW.{log.first_id.name} AND NEW.{log.last_id.name})) "
+            "BEGIN "
+            f"SELECT RAISE(ABORT, 'archive_log entry does not match the {table.table} records'); "
+            "END"
+        )
+    return statements
+
+def customer_summary_sql(md: InventoryMetadata = db_metadata):
+    """Triggers keeping the per-customer summaries current, i.e. within
+    the very transaction that writes a checkin/checkout.
+
+    items_out holds one row per item currently rented out,
+    customer_summary one row per customer.
+
+    :rtype: list of str
+    """
+    customers, ins, outs = md.customers, md.checkins, md.checkouts
+    out, summary = md.items_out, md.customer_summaries
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {customers.table}_summary_init "
+        f"AFTER INSERT ON {customers.table} "
+        "BEGIN "
+        f"INSERT INTO {summary.table} ({summary.customer_id.name}) VALUES (NEW.{customers.id.name}); "
+        "END",
+        f"CREATE TRIGGER IF NOT EXISTS {outs.table}_summary "
+        f"AFTER INSERT ON {outs.table} "
+        "BEGIN "
+        f"INSERT INTO {out.table} ({out.inv_nr.name}, {out.customer_id.name}, {out.checkout_id.name}, "
+        f"{out.time.name}, {out.due.name}) "
+        f"VALUES (NEW.{outs.inv_nr.name}, NEW.{outs.customer_id.name}, NEW.{outs.id.name}, "
+        f"NEW.{outs.time.name}, NEW.{outs.due.name}); "
+        f"UPDATE {summary.table} SET {summary.items_out.name} = {summary.items_out.name} + 1, "
+        f"{summary.lifetime_rentals.name} = {summary.lifetime_rentals.name} + 1 "
+        f"WHERE {summary.customer_id.name} = NEW.{outs.customer_id.name}; "
+        "END",
+        f"CREATE TRIGGER IF NOT EXISTS {ins.table}_summary "
+        f"AFTER INSERT ON {ins.table} "
+        "BEGIN "
+        "SELECT RAISE(ABORT, 'item is not checked out') "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {out.table} WHERE {out.inv_nr.name} = NEW.{ins.inv_nr.name}); "
+        f"UPDATE {summary.table} SET {summary.items_out.name} = {summary.items_out.name} - 1 "
+        f"WHERE {summary.customer_id.name} = (SELECT {out.customer_id.name} FROM {out.table} "
+        f"WHERE {out.inv_nr.name} = NEW.{ins.inv_nr.name}); "
+        f"DELETE FROM {out.table} WHERE {out.inv_nr.name} = NEW.{ins.inv_nr.name}; "
+        "END",
+    ]
 
+def customer_summary_rebuild_sql(md: InventoryMetadata = db_metadata):
+    """Statements filling freshly created summary tables from the existing history.
 
-def open_db(filepath) -> str:
+    :rtype: list of str
+    """
+    customers, out, summary = md.customers, md.items_out, md.customer_summaries
+    outs, ins = md.checkouts, md.checkins
+    checkouts, checkins = history_view(outs.table), history_view(ins.table)
+    return [
+        f"INSERT INTO {out.table} ({out.inv_nr.name}, {out.customer_id.name}, {out.checkout_id.name}, "
+        f"{out.time.name}, {out.due.name}) "
+        f"SELECT o.{outs.inv_nr.name}, o.{outs.customer_id.name}, o.{outs.id.name}, "
+        f"o.{outs.time.name}, o.{outs.due.name} FROM {checkouts} o "
+        f"JOIN (SELECT {outs.inv_nr.name}, MAX({outs.id.name}) AS last_id, COUNT(*) AS n FROM {checkouts} "
+        f"GROUP BY {outs.inv_nr.name}) outs ON outs.last_id = o.{outs.id.name} "
+        f"LEFT JOIN (SELECT {ins.inv_nr.name}, COUNT(*) AS n FROM {checkins} "
+        f"GROUP BY {ins.inv_nr.name}) ins ON ins.{ins.inv_nr.name} = o.{outs.inv_nr.name} "
+        "WHERE outs.n > COALESCE(ins.n, 0)",
+        f"INSERT INTO {summary.table} ({summary.customer_id.name}, {summary.items_out.name}, "
+        f"{summary.lifetime_rentals.name}) "
+        f"SELECT c.{customers.id.name}, COALESCE(o.n, 0), COALESCE(r.n, 0) FROM {customers.table} c "
+        f"LEFT JOIN (SELECT {out.customer_id.name}, COUNT(*) AS n FROM {out.table} "
+        f"GROUP BY {out.customer_id.name}) o ON o.{out.customer_id.name} = c.{customers.id.name} "
+        f"LEFT JOIN (SELECT {outs.customer_id.name}, COUNT(*) AS n FROM {checkouts} "
+        f"GROUP BY {outs.customer_id.name}) r ON r.{outs.customer_id.name} = c.{customers.id.name}",
+    ]
+
+ARCHIVE_SCHEMA = 'archive' # name the archive file is attached under
+
+def open_db(filepath, conn_name='', pragmas=None) -> str:
     """Opens an SQLite DB.
 
     :param filepath: path to an SQLite file.
     :type filepath: path
+    :param conn_name: connection name to register, defaults to the file name.
+    Needed when several files share a name or one file is opened
+    from several threads.
+    :type conn_name: str, optional
+    :param pragmas: per-connection settings to apply, e.g.
+    {'busy_timeout': 5000, 'synchronous': 'NORMAL'}
+    :type pragmas: dict, optional
     :return: connection name (QtSQL connectionName attribute), empty if unsuccessful
     :rtype: str
     """
-    name = path.basename(filepath)
+    name = conn_name if conn_name else path.basename(filepath)
     db = QSqlDatabase.addDatabase("QSQLITE", connectionName=name)
     db.setDatabaseName(filepath)
+    db.setConnectOptions("QSQLITE_OPEN_URI") # the archive is attached by a read-only URI
     if db.open():
+        # SQLite leaves FK enforcement off unless asked per connection
+        QSqlQuery("PRAGMA foreign_keys = ON", db).finish()
+        for pragma, value in (pragmas or {}).items():
+            QSqlQuery(f"PRAGMA {pragma} = {value}", db).finish()
+        attach_archive(db, filepath)
         return name
     else:
         return ''
 
+def archive_path(filepath) -> str:
+    """The history archive of a database file: '<name>.archive<ext>' next to it."""
+    root, ext = path.splitext(filepath)
+    return f"{root}.archive{ext}"
+
+def history_view(table) -> str:
+    """Temporary view over a history table's rows in the main file and the archive."""
+    return f"{table}_history"
+
+def attach_archive(db, filepath, writable=False, md: InventoryMetadata = db_metadata) -> bool:
+    """(Re)attach a database file's history archive as 'archive' and
+    (re)create the history views over it.
+
+    Without an archive file the views cover the main file only.
+
+    :param db: open connection to filepath, with no transaction in progress
+    :type db: QSqlDatabase
+    :param writable: attach for writing, creating the archive if needed;
+    only archiving should
+    :type writable: bool
+    :return: whether an archive is attached
+    :rtype: bool
+    """
+    query = QSqlQuery(db)
+    query.exec("PRAGMA database_list")
+    attached = False
+    while query.next():
+        attached = attached or query.value(1) == ARCHIVE_SCHEMA
+    if attached:
+        query.exec(f"DETACH DATABASE {ARCHIVE_SCHEMA}")
+    archive = path.abspath(archive_path(filepath))
+    attached = False
+    if writable or path.exists(archive):
+        query.prepare(f"ATTACH DATABASE :archive AS {ARCHIVE_SCHEMA}")
+        query.bindValue(":archive", archive if writable else f"file:{quote(archive)}?mode=ro")
+        attached = query.exec()
+    for table in (md.checkins, md.checkouts):
+        cols = ', '.join(c.name for c in table.columns())
+        sources = [f"SELECT {cols} FROM main.{table.table}"]
+        if attached:
+            sources.append(f"SELECT {cols} FROM {ARCHIVE_SCHEMA}.{table.table}")
+        query.exec(f"DROP VIEW IF EXISTS temp.{history_view(table.table)}")
+        query.exec(f"CREATE TEMP VIEW {history_view(table.table)} AS {' UNION ALL '.join(sources)}")
+    query.finish()
+    return attached
+
+def archive_schema_sql(md: InventoryMetadata = db_metadata):
+    """The statements creating the attached archive's tables.
+
+    :rtype: list of str
+    """
+    statements = [md.archive_log.create_sql(ARCHIVE_SCHEMA)] + md.archive_log.trigger_sql(ARCHIVE_SCHEMA)
+    for table in md.tables():
+        if table.archivable:
+            statements += [table.create_sql(ARCHIVE_SCHEMA)] \
+                + table.index_sql(ARCHIVE_SCHEMA) + table.trigger_sql(ARCHIVE_SCHEMA)
+    return statements
+
+def create_archive(db, filepath, md: InventoryMetadata = db_metadata) -> bool:
+    """Create a database file's history archive, empty, unless it
+    exists, and attach it read-only.
+
+    :param db: open connection to filepath, with no transaction in progress
+    :type db: QSqlDatabase
+    :return: whether the archive is attached
+    :rtype: bool
+    """
+    if not path.exists(archive_path(filepath)):
+        attach_archive(db, filepath, writable=True, md=md)
+        query = QSqlQuery(db)
+        for statement in archive_schema_sql(md):
+            query.exec(statement)
+        query.finish()
+    return attach_archive(db, filepath, md=md)
+
+def schema_sql(md: InventoryMetadata = db_metadata):
+    """All the statements creating LightRental's tables, indexes and triggers.
+
+    Generated from the metadata; every statement is IF NOT EXISTS,
+    so running them on an older file only adds what it lacks.
+
+    :rtype: list of str
+    """
+    statements = [table.create_sql() for table in md.tables()]
+    for table in md.tables():
+        statements += table.index_sql()
+        statements += table.trigger_sql()
+    return statements + customer_summary_sql(md) + change_log_sql(md) + archive_log_sql(md)
+
 def create_db(filepath: str, md: InventoryMetadata = db_metadata) -> str:
     """Creates an SQLite DB with a structure needed for LightRental.
 
     :param filepath: path and name for the new DB; if a DB exists,
     DB creation is aborted to prevent overwriting it.
     :type filepath: path
+    :param md: metadata the schema is generated from
+    :type md: InventoryMetadata
     :return: connection name (QtSQL connectionName attribute), empty if unsuccessful.
     :rtype: str
     """
-    CHECK_IN_OUT_COLUMNS_SQL = ("id PRIMARY KEY AUTOINCREMENT,"
-                "time TEXT NOT NULL,"
-                "customer_id INTEGER NOT NULL,"
-                "inv_nr INTEGER NOT NULL,"
-                "FOREIGN KEY (inv_nr) REFERENCES inventory (inv_nr)"
-                " ON DELETE RESTRICT ON UPDATE CASCADE,"
-                "FOREIGN KEY (customer_id) REFERENCES customers (id)"
-                " ON DELETE RESTRICT ON UPDATE CASCADE,")
     name = path.basename(filepath)
     if path.exists(filepath):
         print(f"{name} already exists. \
@@ -158,68 +721,24 @@ def create_db(filepath: str, md: InventoryMetadata = db_metadata) -> str:
     else:
         db = QSqlDatabase.addDatabase("QSQLITE", connectionName=name)
         db.setDatabaseName(filepath)
+        db.setConnectOptions("QSQLITE_OPEN_URI")
         if db.open():
+            query = QSqlQuery(db)
+            # a no-op inside a transaction, hence before it
+            query.exec(
+                "PRAGMA foreign_keys = ON"
+            )
+            # lets maintenance return free pages bit by bit; must precede the first table
+            query.exec("PRAGMA auto_vacuum = INCREMENTAL")
             if db.transaction():
-                query = QSqlQuery(db)
-                query.exec(
-                    "PRAGMA foreign_keys = true"
-                )
-                query.exec(
-                    "CREATE TABLE inventory ("
-                    "inv_nr INTEGER PRIMARY KEY ON CONFLICT ROLLBACK,"
-                    "sku INTEGER NOT NULL,"
-                    "category INTEGER NOT NULL,"
-                    "img_path TEXT,"
-                    "notes TEXT,"
-                    "FOREIGN KEY (sku) REFERENCES skus (sku)"
-                    " ON DELETE RESTRICT ON UPDATE CASCADE,"
-                    "FOREIGN KEY (category) REFERENCES categories (id)"
-                    " ON DELETE RESTRICT ON UPDATE CASCADE,"
-                    ")"
-                )
-                query.exec(
-                    "CREATE TABLE skus ("
-                    "sku INTEGER PRIMARY KEY,"
-                    "name TEXT NOT NULL,"
-                    "notes TEXT"
-                    ")"
-                )
-                query.exec(
-                    "CREATE TABLE categories ("
-                    "id INTEGER PRIMARY KEY,"
-                    "name TEXT NOT NULL,"
-                    "notes TEXT"
-                    ")"
-                )
-                query.exec(
-                    "CREATE TABLE customers ("
-                    "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-                    "name TEXT NOT NULL,"
-                    "contacts TEXT NOT NULL,"
-                    "notes TEXT"
-                    ")"
-                )
-                query.exec(
-                    "CREATE TABLE checkin ("
-                    + CHECK_IN_OUT_COLUMNS_SQL +
-                    ")"
-                )
-                for table_name in ['customers', 'checkin', 'checkout']:
-                    del_trigger_query = (
-                        f"CREATE TRIGGER {table_name}_prevent_deletion "
-                        f"BEFORE DELETE ON {table_name} "
-                        "BEGIN"
-                        f"SELECT RAISE(ABORT, '{table_name} records cannot be deleted')"
-                        "END;"
-                    )
-                    query.exec(del_trigger_query)
-                    query.finish()
-                query.exec(
-                    "CREATE TABLE checkout ("
-                    + CHECK_IN_OUT_COLUMNS_SQL +
-                    ")"
-                )
+                for statement in schema_sql(md):
+                    if not query.exec(statement):
+                        query.finish()
+                        db.rollback()
+                        return ""
+                query.finish()
                 db.commit()
+                create_archive(db, filepath, md=md)
                 return name
         return ""
 
@@ -227,9 +746,12 @@ class InventoryDB:
     """A database service that abstracts away the SQL under
     inventory item-specific methods.
 
-    Note that each method obtains a fresh database handle,
-    following the Qt docs' recommendation not to store the 
-    handle as a member.
+    Table names, columns and relations all come from the metadata.
+    INSERT and SELECT statements are generated from it and prepared
+    once, when the object is created; other frequent queries are
+    prepared on first use and reused afterwards. Prepared queries
+    keep a reference to the connection, so drop this object before
+    removing the connection.
 
     The 'inventory', 'SKU' and 'categories' expose their names
     via this class' methods so that they can be directly acessed
@@ -237,97 +759,423 @@ class InventoryDB:
     On the contrary, records in 'checkin' and 'checkout' shouldn't 
     be ever edited or updated. One can insert records to those
     table only using this class' methods.
+
+    If a ChangeBus is given, every successful write is published
+    on it as a row-level ChangeEvent. The QSqlError of the last failed
+    checkin/checkout or read is kept in last_error, e.g. to tell a
+    locked database (SQLITE_BUSY) from a rejected move.
     """
-    def __init__(self, connectionName='') -> None:
+    def __init__(self, connectionName='', bus=None, md: InventoryMetadata = db_metadata) -> None:
         self.conn_name = connectionName
-        self.inv_tbl_name = 'inventory'
-        self.SKU_tbl_name = 'SKUs'
-        self.cat_tbl_name = 'categories'
-        self.customer_tbl_name = 'customers'
-        self.index_SKU = 1
-        self.index_category = 2
+        self.bus = bus
+        self.md = md
+        self.statements = {}
+        self.last_error = None
+        self._prepare_tables()
     def connection_handle(self):
         return QSqlDatabase.database(self.conn_name)
     def inventory_table_name(self):
-        return self.inv_tbl_name
+        return self.md.items.table
     def SKU_table_name(self):
-        return self.SKU_tbl_name
+        return self.md.SKUs.table
+    def category_table_name(self):
+        return self.md.categories.table
     def customer_table_name(self):
-        return self.customer_tbl_name
+        return self.md.customers.table
     def SKU_relation(self):
-        pass
+        return self.md.items.SKU.index, self.md.items.SKU.relation.qt_relation()
     def category_relation(self):
-        return self.index_category, 
+        return self.md.items.category_id.index, self.md.items.category_id.relation.qt_relation()
     def add_customer(self, id, name, contacts, notes=''):
-        query = self._fresh_QSqlQuery()
-        query.prepare(
-            "INSERT INTO customers (id, name, contacts, notes) "
-            "VALUES (:id, :name, :contacts, :notes)"
-        )
-        query.bindValue(":id", id)
-        query.bindValue(":name", name)
-        query.bindValue(":contacts", contacts)
-        query.bindValue(":notes", notes)
-        return query.exec()
+        ok, row_id = self._insert(self.md.customers,
+            id=id, name=name, contacts=contacts, notes=notes)
+        if ok:
+            self._publish(self.md.customers.table, row_id)
+        return ok
     def add_item(self, nr, SKU, category, notes="", imgpath=""):
-        query = self._fresh_QSqlQuery()
-        query.prepare(
-            "INSERT INTO inventory (inv_nr, sku, category, notes, img_path) "
-            "VALUES (:inv_nr, :sku, :category, :notes, :img_path)"
-        )
-        query.bindValue(":sku", SKU)
-        query.bindValue(":inv_nr", nr)
-        query.bindValue(":category", category)
-        query.bindValue(":notes", notes)
-        query.bindValue(":img_path", imgpath)
-        return query.exec()
+        ok, _row_id = self._insert(self.md.items,
+            inv_nr=nr, sku=SKU, category=category, notes=notes, img_path=imgpath)
+        if ok:
+            self._publish(self.md.items.table, nr)
+        return ok
     def add_SKU(self, SKU, sku_name, itm_nr, itm_cat, sku_notes='', itm_notes='', itm_imgpaths=''):
         db = self.connection_handle()
         if db.transaction():
-            query = QSqlQuery(db)
-            query.prepare(
-                "INSERT INTO skus (sku, name, notes) "
-                "VALUES (:sku, :name, :notes)"
-            )
-            query.bindValue(":sku", SKU)
-            query.bindValue(":name", sku_name)
-            query.bindValue(":notes", sku_notes)
-            query.exec()
-            query.prepare(
-                "INSERT INTO inventory (inv_nr, sku, category, notes, img_path) "
-                "VALUES (:inv_nr, :sku, :category, :notes, :img_path)"
-            )
-            query.bindValue(":sku", SKU)
-            query.bindValue(":inv_nr", itm_nr)
-            query.bindValue(":category", itm_cat)
-            query.bindValue(":notes", itm_notes)
-            query.bindValue(":img_path", itm_imgpaths)
-            query.exec()
-            db.commit()
+            ok, _row_id = self._insert(self.md.SKUs, sku=SKU, name=sku_name, notes=sku_notes)
+            if ok:
+                ok, _row_id = self._insert(self.md.items,
+                    inv_nr=itm_nr, sku=SKU, category=itm_cat, notes=itm_notes, img_path=itm_imgpaths)
+            if not ok:
+                db.rollback()
+                return False
+            if not db.commit():
+                return False
+            self._publish(self.md.SKUs.table, SKU)
+            self._publish(self.md.items.table, itm_nr)
             return True
         else:
             return False
     def add_category(self, name, notes="") -> bool:
-        query = self._fresh_QSqlQuery()
-        query.prepare(
-            "INSERT INTO categories (name, notes) "
-            "VALUES (:name, :notes)"
+        ok, row_id = self._insert(self.md.categories, name=name, notes=notes)
+        if ok:
+            self._publish(self.md.categories.table, row_id)
+        return ok
+    def record(self, table, key):
+        """Fetch one row by primary key.
+
+        :param table: table name
+        :type table: str
+        :return: column name -> value, None if there's no such row
+        :rtype: dict
+        """
+        query = self.selects[table]
+        query.bindValue(":key", key)
+        query.exec()
+        row = None
+        if query.next():
+            row = {c.name: query.value(c.index) for c in self.md.table(table).columns()}
+        query.finish()
+        return row
+    def search_SKUs(self, pattern):
+        """Find SKUs whose name contains a substring.
+
+        :param pattern: substring to look for, case-insensitive
+        :type pattern: str
+        :return: (sku, name, notes) tuples ordered by SKU
+        :rtype: list
+        """
+        query = self._statement(
+            "SELECT sku, name, notes FROM skus "
+            "WHERE name LIKE :pattern ORDER BY sku"
         )
-        query.bindValue(":name", name)
-        query.bindValue(":notes", notes)
-        return query.exec()
-    def checkin(self, nr, customer_id):
-        query = self._fresh_QSqlQuery()
-        query.prepare(
+        query.bindValue(":pattern", f"%{pattern}%")
+        return self._rows(query, 3)
+    def available_items(self, SKU):
+        """List items of an SKU that are not checked out.
+
+        An item is out if it has a row in items_out.
+
+        :param SKU: SKU to look up
+        :type SKU: int
+        :return: inventory numbers in ascending order
+        :rtype: list
+        """
+        query = self._statement(
+            "SELECT i.inv_nr FROM inventory i WHERE i.sku = :sku AND "
+            "NOT EXISTS (SELECT 1 FROM items_out o WHERE o.inv_nr = i.inv_nr) "
+            "ORDER BY i.inv_nr"
+        )
+        query.bindValue(":sku", SKU)
+        return [row[0] for row in self._rows(query, 1)]
+    def inventory_numbers(self):
+        """Fetch all inventory numbers in one pass, e.g. for validating scans.
+
+        :rtype: set
+        """
+        query = self._statement("SELECT inv_nr FROM inventory")
+        return {row[0] for row in self._rows(query, 1)}
+    def item_notes(self):
+        """Fetch the notes of all items that have any, e.g. for a search index.
+
+        :return: (inv_nr, notes) tuples
+        :rtype: list
+        """
+        query = self._statement(
+            "SELECT inv_nr, notes FROM inventory WHERE notes IS NOT NULL AND notes <> ''"
+        )
+        return self._rows(query, 2)
+    def out_inventory_numbers(self):
+        """Fetch the inventory numbers of all items currently checked out.
+
+        :rtype: set
+        """
+        query = self._statement("SELECT inv_nr FROM items_out")
+        return {row[0] for row in self._rows(query, 1)}
+    def checkin(self, nr, customer_id=None):
+        return self.checkin_many([nr], customer_id)
+    def checkout(self, nr, customer_id, due=None):
+        return self.checkout_many([nr], customer_id, due)
+    def checkin_many(self, nrs, customer_id=None):
+        """Check a batch of items in within one transaction.
+
+        :param nrs: inventory numbers
+        :type nrs: iterable of int
+        :param customer_id: who returns the items; if None, the
+        customer each item is rented to
+        :type customer_id: int, optional
+        :return: True if all items were checked in, False if none were;
+        fails if any of the items isn't checked out
+        :rtype: bool
+        """
+        query = self._statement(
             "INSERT INTO checkin (inv_nr, customer_id, time) "
-            "VALUES (:inv_nr, :customer_id, :time)"
+            "SELECT n.inv_nr, COALESCE(:customer_id, o.customer_id), :time "
+            "FROM (SELECT :inv_nr AS inv_nr) n "
+            "LEFT JOIN items_out o ON o.inv_nr = n.inv_nr"
+        )
+        return self._insert_moves(
+            self.md.checkins.table, query, nrs, {":customer_id": customer_id}
+        )
+    def checkout_many(self, nrs, customer_id, due=None):
+        """Check a batch of items out to a customer within one transaction.
+
+        :param due: agreed return time, 'YYYY-MM-DD HH:MM:SS'
+        :type due: str, optional
+        :return: True if all items were checked out, False if none were;
+        fails if any of the items is already out
+        :rtype: bool
+        """
+        return self._insert_moves(
+            self.md.checkouts.table, self.inserts[self.md.checkouts.table], nrs,
+            {":id": None, ":customer_id": customer_id, ":due": due}
+        )
+    def _insert_moves(self, table, query, nrs, values):
+        """Run a checkin/checkout INSERT for each item, all or nothing.
+
+        :param query: prepared INSERT taking :inv_nr and :time
+        :type query: QSqlQuery
+        :param values: placeholder -> value bound for all items
+        :type values: dict
+        """
+        db = self.connection_handle()
+        if not db.transaction():
+            self.last_error = db.lastError()
+            return False
+        time = datetime.now().isoformat(sep=' ', timespec='seconds')
+        row_ids = []
+        for nr in nrs:
+            query.bindValue(":inv_nr", nr)
+            query.bindValue(":time", time)
+            for placeholder, value in values.items():
+                query.bindValue(placeholder, value)
+            if not query.exec():
+                self.last_error = query.lastError()
+                query.finish()
+                db.rollback()
+                return False
+            row_ids.append(query.lastInsertId())
+        query.finish()
+        if not db.commit():
+            # a COMMIT refused with SQLITE_BUSY leaves the transaction open
+            self.last_error = db.lastError()
+            db.rollback()
+            return False
+        for row_id in row_ids:
+            self._publish(table, row_id)
+        return True
+    def ensure_schema(self) -> bool:
+        """Add whatever tables, indexes and triggers a file created by
+        an older version lacks.
+
+        Customer summary tables, when missing, are filled from the
+        existing history once; after that, triggers keep them current.
+
+        :return: False if the upgrade failed and was rolled back
+        :rtype: bool
+        """
+        db = self.connection_handle()
+        create_archive(db, db.databaseName(), md=self.md)
+        existing = db.tables()
+        query = QSqlQuery(db)
+        query.exec("SELECT name FROM main.sqlite_master WHERE type = 'trigger'")
+        triggers = set()
+        while query.next():
+            triggers.add(query.value(0))
+        wanted = {
+            statement.split()[5] for statement in schema_sql(self.md)
+            if statement.startswith("CREATE TRIGGER")
+        }
+        if all(table.table in existing for table in self.md.tables()) and wanted <= triggers:
+            query.finish()
+            return True
+        query.finish()
+        if not db.transaction():
+            return False
+        ok = True
+        if db.record(self.md.checkouts.table).indexOf(self.md.checkouts.due.name) == -1:
+            ok = query.exec(f"ALTER TABLE {self.md.checkouts.table} ADD COLUMN {self.md.checkouts.due.sql()}")
+        statements = []
+        if self.md.archive_log.table not in existing:
+            # older deletion guards don't let archived rows go
+            statements += [
+                f"DROP TRIGGER IF EXISTS {table.table}_prevent_deletion"
+                for table in self.md.tables() if table.archivable
+            ]
+        statements += schema_sql(self.md)
+        if self.md.customer_summaries.table not in existing:
+            statements += customer_summary_rebuild_sql(self.md)
+        for statement in statements:
+            ok = ok and query.exec(statement)
+        query.finish()
+        if not ok:
+            db.rollback()
+            return False
+        if not db.commit():
+            return False
+        self._prepare_tables() # statements on the new tables failed to prepare before
+        return True
+    def customer_summaries(self):
+        """Per-customer rental counts for dashboards and customer pickers.
+
+        Reads the summary tables only, so the cost doesn't depend on
+        the length of the history.
+
+        :return: (id, name, items_out, lifetime_rentals, overdue) tuples ordered by name
+        :rtype: list
+        """
+        query = self._statement(
+            "SELECT c.id, c.name, s.items_out, s.lifetime_rentals, "
+            "COALESCE(late.n, 0) FROM customers c "
+            "JOIN customer_summary s ON s.customer_id = c.id "
+            "LEFT JOIN (SELECT customer_id, COUNT(*) AS n FROM items_out "
+            "WHERE due < :now GROUP BY customer_id) late "
+            "ON late.customer_id = c.id "
+            "ORDER BY c.name"
+        )
+        query.bindValue(":now", datetime.now().isoformat(sep=' ', timespec='seconds'))
+        return self._rows(query, 5)
+    def items_out(self, customer_id):
+        """Items currently rented to a customer.
+
+        :return: (inv_nr, sku name, checkout time, due) tuples, oldest first
+        :rtype: list
+        """
+        query = self._statement(
+            "SELECT o.inv_nr, s.name, o.time, o.due FROM items_out o "
+            "JOIN inventory i ON i.inv_nr = o.inv_nr "
+            "JOIN skus s ON s.sku = i.sku "
+            "WHERE o.customer_id = :customer_id ORDER BY o.time"
         )
-        query.bindValue(":inv_nr", nr)
         query.bindValue(":customer_id", customer_id)
-        return False
-    def checkout(self, nr, customer_id):
-        return False
+        return self._rows(query, 4)
+    def history(self, table, after_id=0):
+        """Fetch checkin or checkout records newer than a given one.
+
+        Records are append-only, so a view can keep what it has
+        and ask only for records past the last id it holds.
+        Archived records are included.
+
+        :param table: 'checkin' or 'checkout'
+        :type table: str
+        :param after_id: last id already known, 0 for the full history
+        :type after_id: int
+        :return: (id, time, inv_nr, customer_id) tuples ordered by id
+        :rtype: list
+        """
+        if table not in (self.md.checkins.table, self.md.checkouts.table):
+            raise ValueError(f"{table} is not a history table")
+        query = self._statement(
+            f"SELECT id, time, inv_nr, customer_id FROM {history_view(table)} "
+            "WHERE id > :after_id ORDER BY id"
+        )
+        query.bindValue(":after_id", after_id)
+        return self._rows(query, 4)
+    def last_id(self, table) -> int:
+        """Greatest primary key in a table, 0 if it's empty.
+
+        Archived checkin/checkout records count, so e.g. a view can
+        follow the history from here on with history(table, last_id).
+        """
+        t = self.md.table(table)
+        source = history_view(table) if t.archivable else table
+        # not MAX(): on the UNION ALL view only ORDER BY ... LIMIT uses the rowids
+        query = self._statement(f"SELECT {t.key().name} FROM {source} ORDER BY {t.key().name} DESC LIMIT 1")
+        rows = self._rows(query, 1)
+        return rows[0][0] if rows else 0
+    def history_page(self, table, before_id=None, limit=500):
+        """Fetch checkin or checkout records older than a given one, newest first.
+
+        Lets views page backwards through a long history instead of
+        loading all of it. Archived records are included.
+
+        :param before_id: first id not to fetch; None to start at the newest record
+        :type before_id: int, optional
+        :return: (id, time, inv_nr, customer_id) tuples ordered by id, descending
+        :rtype: list
+        """
+        if table not in (self.md.checkins.table, self.md.checkouts.table):
+            raise ValueError(f"{table} is not a history table")
+        query = self._statement(
+            f"SELECT id, time, inv_nr, customer_id FROM {history_view(table)} "
+            "WHERE id < :before_id ORDER BY id DESC LIMIT :limit"
+        )
+        query.bindValue(":before_id", before_id if before_id is not None else 2**62)
+        query.bindValue(":limit", limit)
+        return self._rows(query, 4)
+    def changes(self, after_id):
+        """Fetch change_log entries past a given one.
+
+        :return: (id, table, key, op) tuples ordered by id
+        :rtype: list
+        """
+        log = self.md.change_log
+        query = self._statement(
+            f"SELECT {', '.join(c.name for c in log.columns())} FROM {log.table} "
+            f"WHERE {log.id.name} > :after_id ORDER BY {log.id.name}"
+        )
+        query.bindValue(":after_id", after_id)
+        return self._rows(query, 4)
+    def copy_to(self, filepath) -> bool:
+        """Write a consistent, compacted copy of the database to a new file.
+
+        Safe while other connections keep writing.
+        """
+        query = QSqlQuery(self.connection_handle())
+        query.prepare("VACUUM INTO :filepath")
+        query.bindValue(":filepath", filepath)
+        ok = query.exec()
+        query.finish()
+        return ok
+    def data_version(self) -> int:
+        """SQLite's PRAGMA data_version: changes whenever another connection commits."""
+        query = self._statement("PRAGMA data_version")
+        rows = self._rows(query, 1)
+        return rows[0][0] if rows else 0
+    def _insert(self, table, **values):
+        """Run a table's prepared INSERT; columns not given are NULL.
+
+        :return: success and the new row's id
+        :rtype: tuple
+        """
+        query = self.inserts[table.table]
+        for col in table.columns():
+            query.bindValue(f":{col.name}", values.get(col.name))
+        ok = query.exec()
+        row_id = query.lastInsertId()
+        query.finish()
+        return ok, row_id
+    def _prepare_tables(self):
+        """Prepare the generated INSERT and SELECT of every table."""
+        self.inserts = {}
+        self.selects = {}
+        for table in self.md.tables():
+            self.inserts[table.table] = self._prepare(table.insert_sql())
+            self.selects[table.table] = self._prepare(table.select_sql())
+    def _statement(self, sql):
+        """Prepare a query on first use, reuse it afterwards."""
+        query = self.statements.get(sql)
+        if query is None:
+            query = self._prepare(sql)
+            self.statements[sql] = query
+        return query
+    def _prepare(self, sql):
+        query = self._fresh_QSqlQuery()
+        query.setForwardOnly(True)
+        query.prepare(sql)
+        return query
+    def _rows(self, query, ncols):
+        """Execute a prepared SELECT, fetch all rows and release the statement."""
+        if not query.exec():
+            self.last_error = query.lastError()
+        rows = []
+        while query.next():
+            rows.append(tuple(query.value(i) for i in range(ncols)))
+        query.finish()
+        return rows
+    def _publish(self, table, key):
+        if self.bus is not None:
+            self.bus.publish(table, key)
     def _fresh_QSqlQuery(self):
         db = QSqlDatabase.database(self.conn_name)
         query = QSqlQuery(db)
-        return query
\ No newline at end of file
+        return query
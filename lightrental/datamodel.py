@@ -7,10 +7,12 @@ without directly calling database.py functions and
 worrying about integrity.
 """
 
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
 from PyQt5.QtSql import (
     QSqlRelationalTableModel
 )
 from collections import namedtuple
+from .changes import DELETE
 # uses InventoryDB interface
 
 InventoryItem = namedtuple(
@@ -36,13 +38,45 @@ class InventoryModel(QSqlRelationalTableModel):
         :param db: database SQL wrapper object
         :type db: InventoryDB
         """
-        super().__init__(db.connection_handle())
+        super().__init__(None, db.connection_handle())
         self.db = db
         super().setTable(self.db.inventory_table_name())
+        # relations come from the metadata, see database.db_metadata
         col, rel = self.db.SKU_relation()
         super().setRelation(col, rel)
         col, rel = self.db.category_relation()
         super().setRelation(col, rel)
+        # inserts and deletes arriving together cost a single select()
+        self.reselect = QTimer(self)
+        self.reselect.setSingleShot(True)
+        self.reselect.timeout.connect(self.select)
+        if self.db.bus is not None:
+            self.db.bus.changed.connect(self.on_change)
+            self.db.bus.external_change.connect(self.reselect.start)
+    def on_change(self, event):
+        """Apply a row-level change, made here or by another counter.
+
+        Updated rows are re-read one by one. QSqlTableModel can't
+        append or drop a single row, so inserts and deletes schedule
+        one select() for all that arrive together - unless the model
+        hasn't fetched all rows yet, then a new row simply arrives with
+        the next fetch. Moves (checkins, checkouts) don't concern it.
+
+        :param event: what has changed
+        :type event: ChangeEvent
+        """
+        if event.table == self.tableName():
+            found = self.match(
+                self.index(0, 0), Qt.EditRole, event.key, 1, Qt.MatchExactly
+            )
+            if found and event.op != DELETE:
+                self.selectRow(found[0].row())
+            elif found or not self.canFetchMore():
+                self.reselect.start()
+        else:
+            for col in range(self.columnCount()):
+                if self.relation(col).tableName() == event.table:
+                    self.relationModel(col).select()
     def add_item(self, item):
         self.db.add_item(
             nr=item.nr,
@@ -72,11 +106,86 @@ class InventoryModel(QSqlRelationalTableModel):
             itm_nr=item.nr,
             itm_cat=item.category,
             itm_notes=item.notes,
-            itm_imgpath=item.imgpath
+            itm_imgpaths=item.imgpath
         )
     def add_category(self, cat):
         self.db.add_category(
-            id=cat.id,
             name=cat.name,
             notes=cat.notes
-        )
\ No newline at end of file
+        )
+
+class HistoryModel(QAbstractTableModel):
+    """Read-only model of the checkin or checkout history, newest first.
+
+    Only the newest page_size records are loaded at first; views
+    page further back through canFetchMore/fetchMore as they scroll.
+    History is append-only, so the model keeps the records it has
+    and only fetches the ones past its last id, announcing them with
+    rowsInserted at the top rather than resetting the view.
+    """
+    headers = ['id', 'time', 'inv. number', 'customer']
+
+    def __init__(self, db, table, parent=None, page_size=500) -> None:
+        """Load the newest records of a history table and subscribe to its changes.
+
+        :param db: database SQL wrapper object
+        :type db: InventoryDB
+        :param table: 'checkin' or 'checkout'
+        :type table: str
+        :param page_size: records loaded at a time
+        :type page_size: int
+        """
+        super().__init__(parent)
+        self.db = db
+        self.table = table
+        self.page_size = page_size
+        self.older = self.db.history_page(self.table, limit=page_size) # newest first
+        self.newer = [] # fetched since, oldest first
+        self.exhausted = len(self.older) < page_size
+        if self.db.bus is not None:
+            self.db.bus.changed.connect(self.on_change)
+            self.db.bus.external_change.connect(self.fetch_new)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.newer) + len(self.older)
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        return self.record(index.row())[index.column()]
+    def record(self, row):
+        if row < len(self.newer):
+            return self.newer[len(self.newer) - 1 - row]
+        return self.older[row - len(self.newer)]
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+    def on_change(self, event):
+        if event.table == self.table:
+            self.fetch_new()
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+    def fetchMore(self, parent=QModelIndex()):
+        """Load the next page of older records."""
+        if parent.isValid() or self.exhausted:
+            return
+        before_id = self.older[-1][0] if self.older else None
+        page = self.db.history_page(self.table, before_id, self.page_size)
+        self.exhausted = len(page) < self.page_size
+        if page:
+            first = self.rowCount()
+            self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+            self.older.extend(page)
+            self.endInsertRows()
+    def fetch_new(self):
+        """Insert records written since the last fetch at the top."""
+        if self.newer:
+            last_id = self.newer[-1][0]
+        else:
+            last_id = self.older[0][0] if self.older else 0
+        new = self.db.history(self.table, last_id)
+        if new:
+            self.beginInsertRows(QModelIndex(), 0, len(new) - 1)
+            self.newer.extend(new)
+            self.endInsertRows()
\ No newline at end of file
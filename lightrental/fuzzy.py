@@ -0,0 +1,431 @@
+"""
+LightRental fuzzy lookup.
+
+Typo-tolerant search over SKU names, item notes and customer names,
+plus "did you mean" suggestions for mistyped inventory numbers.
+
+The index has two levels. Distinct words are indexed by their
+trigrams - three-character slices of the word padded with spaces - so
+a query word finds the words resembling it by the share of trigrams
+they have in common. Each word has a posting list, an array of the
+entries containing it. An entry's score is the sum, over the query
+words, of the best similarity among its words. Only candidate entries
+are scored: those containing a word that resembles one of the rarer
+query words, so that a word found in half the inventory ("drill")
+doesn't make every lookup touch half the inventory. Posting lists are
+sorted, so numpy matches candidates against them by binary search.
+Numbers within texts aren't cut into trigrams; a number matches the
+numbers one edit (a wrong, missing, extra or swapped digit) away.
+Short words have too few trigrams for a typo to leave enough of them
+in common ("lanp" shares only " l" and " la" with "lamp"), so they
+also match the words one edit away.
+
+Everything lives in memory and is kept current from the ChangeBus.
+The indexes are built in a background thread, with its own
+connection, when FuzzyLookup is created; lookups find nothing until
+an index is ready, and take milliseconds afterwards.
+"""
+
+import re
+import string
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtCore import QObject
+from PyQt5.QtSql import QSqlDatabase
+from .database import InventoryDB, open_db
+
+WORD = re.compile(r'\w+')
+
+SKU = 'SKU'
+ITEM = 'item'
+CUSTOMER = 'customer'
+NUMBER = 'inventory number'
+BUILD_ORDER = (NUMBER, SKU, CUSTOMER, ITEM) # cheapest first
+
+DIGIT_TYPO_SIMILARITY = 0.6 # of numbers one edit apart
+WORD_TYPO_SIMILARITY = 0.6 # of short words one edit apart
+SHORT_WORD = 5 # letters at most for the one-edit fallback
+
+def trigrams(word) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def words(text) -> set:
+    return set(WORD.findall(text.lower()))
+
+class TrigramIndex:
+    """In-memory fuzzy index of short texts, each under a unique key.
+
+    Removing or replacing an entry only marks its id dead; the posting
+    lists are rebuilt once dead ids outnumber live ones.
+    """
+    def __init__(self, min_word_similarity=0.3, words_per_query_word=8, max_candidates=20000) -> None:
+        """
+        :param min_word_similarity: trigram similarity a word needs to
+        count as a match of a query word, 0..1
+        :type min_word_similarity: float
+        :param words_per_query_word: most similar words considered per query word
+        :type words_per_query_word: int
+        :param max_candidates: query words matching more entries than
+        this don't contribute candidates, unless all of them do
+        :type max_candidates: int
+        """
+        self.min_word_similarity = min_word_similarity
+        self.words_per_query_word = words_per_query_word
+        self.max_candidates = max_candidates
+        self._reset()
+    def _reset(self):
+        self.word_ids = {} # word -> word id
+        self.word_sizes = [] # word id -> number of trigrams, 0 for numbers
+        self.gram_words = {} # trigram -> ids of words containing it
+        self.postings = [] # word id -> array of entry ids
+        self.keys = [] # entry id -> key, None once removed
+        self.texts = [] # entry id -> text
+        self.sizes = array('q') # entry id -> number of distinct words, 0 once removed
+        self.entries = {} # key -> live entry id
+    def __len__(self):
+        return len(self.entries)
+    def add(self, key, text):
+        """Index a text under a key, replacing what the key had."""
+        self.remove(key)
+        entry_words = words(text)
+        if not entry_words:
+            return
+        entry = len(self.keys)
+        self.keys.append(key)
+        self.texts.append(text)
+        self.sizes.append(len(entry_words))
+        self.entries[key] = entry
+        for word in entry_words:
+            self.postings[self._word_id(word)].append(entry)
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.keys[entry] = None
+        self.texts[entry] = None
+        self.sizes[entry] = 0
+        if len(self.keys) > 2 * len(self.entries) + 1024:
+            self._compact()
+    def search(self, text, k=10, min_similarity=0.3):
+        """Find the entries that best match a text.
+
+        An entry's similarity is the mean, over the query words, of
+        the best word similarity it contains; among equal ones,
+        entries with fewer words come first. Only entries containing
+        a match of one of the rarer query words are considered.
+
+        :param k: how many to return, at most
+        :type k: int
+        :param min_similarity: drop entries matching worse than this, 0..1
+        :type min_similarity: float
+        :return: (key, text, similarity) tuples, best first
+        :rtype: list
+        """
+        query_words = words(text)
+        matches = [
+            [(np.frombuffer(self.postings[word_id], dtype=np.int64), similarity)
+             for word_id, similarity in self.similar_words(word)]
+            for word in query_words
+        ]
+        if not any(matches):
+            return []
+        candidates = self._candidates(matches)
+        total = np.zeros(len(candidates), np.float32)
+        for found in matches:
+            best = np.zeros(len(candidates), np.float32)
+            # ascending, so an entry keeps the best similarity among its words
+            for posting, similarity in sorted(found, key=lambda match: match[1]):
+                best[_members(candidates, posting)] = similarity
+            total += best
+        sizes = np.frombuffer(self.sizes, dtype=np.int64)[candidates]
+        score = total - sizes * np.float32(1e-4)
+        score[sizes == 0] = -1
+        n = len(candidates)
+        k = min(k, n)
+        top = np.argpartition(score, n - k)[n - k:]
+        top = top[np.argsort(-score[top], kind='stable')]
+        found = []
+        for i in top:
+            similarity = float(total[i]) / len(query_words)
+            if sizes[i] and similarity >= min_similarity:
+                entry = candidates[i]
+                found.append((self.keys[entry], self.texts[entry], similarity))
+        return found
+    def _candidates(self, matches):
+        """Entries containing a match of a query word matching at most
+        max_candidates entries, or of the rarest query word if none does.
+
+        :param matches: per query word, (posting list, similarity) pairs
+        :type matches: list
+        :return: entry ids, sorted
+        :rtype: numpy.ndarray
+        """
+        counts = [sum(len(posting) for posting, _sim in found) for found in matches]
+        chosen = [found for found, n in zip(matches, counts) if 0 < n <= self.max_candidates]
+        if not chosen:
+            chosen = [min((found for found, n in zip(matches, counts) if n), key=lambda found: sum(
+                len(posting) for posting, _sim in found))]
+        postings = [posting for found in chosen for posting, _sim in found]
+        if len(postings) == 1:
+            return postings[0]
+        merged = np.sort(np.concatenate(postings))
+        return merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+    def similar_words(self, word):
+        """Indexed words resembling a query word.
+
+        :return: (word id, similarity) pairs, most similar first
+        :rtype: list
+        """
+        if word.isdigit():
+            found = [(self.word_ids[word], 1.0)] if word in self.word_ids else []
+            for variant in set(_edits(word)):
+                if variant != word and variant in self.word_ids:
+                    found.append((self.word_ids[variant], DIGIT_TYPO_SIMILARITY))
+            return found[:self.words_per_query_word]
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            word_ids = self.gram_words.get(gram)
+            if word_ids is not None:
+                shared.update(word_ids)
+        best = {}
+        for word_id, n in shared.items():
+            similarity = n / (len(grams) + self.word_sizes[word_id] - n)
+            if similarity >= self.min_word_similarity:
+                best[word_id] = similarity
+        if word.isalpha() and len(word) <= SHORT_WORD:
+            for variant in set(_edits(word, string.ascii_lowercase + word)):
+                word_id = self.word_ids.get(variant)
+                if variant != word and word_id is not None and self.word_sizes[word_id]:
+                    best[word_id] = max(best.get(word_id, 0.0), WORD_TYPO_SIMILARITY)
+        found = sorted(best.items(), key=lambda match: -match[1])
+        return found[:self.words_per_query_word]
+    def _word_id(self, word):
+        word_id = self.word_ids.get(word)
+        if word_id is not None:
+            return word_id
+        word_id = self.word_ids[word] = len(self.postings)
+        self.postings.append(array('q'))
+        if word.isdigit():
+            self.word_sizes.append(0)
+            return word_id
+        grams = trigrams(word)
+        self.word_sizes.append(len(grams))
+        for gram in grams:
+            self.gram_words.setdefault(gram, []).append(word_id)
+        return word_id
+    def _compact(self):
+        live = [(self.keys[entry], self.texts[entry]) for entry in self.entries.values()]
+        self._reset()
+        for key, text in live:
+            self.add(key, text)
+
+def _members(entries, posting):
+    """Mask of the entries that are in a posting list; both sorted, without repeats."""
+    if len(entries) == 0 or len(posting) == 0:
+        return np.zeros(len(entries), bool)
+    if len(posting) < len(entries):
+        # look the shorter array up in the longer one
+        pos = np.minimum(np.searchsorted(entries, posting), len(entries) - 1)
+        mask = np.zeros(len(entries), bool)
+        mask[pos[entries[pos] == posting]] = True
+        return mask
+    pos = np.minimum(np.searchsorted(posting, entries), len(posting) - 1)
+    return posting[pos] == entries
+
+def similar_numbers(text, known, k=5):
+    """Known inventory numbers closest to a possibly mistyped one.
+
+    :param text: what was typed or scanned
+    :type text: str
+    :param known: valid inventory numbers
+    :type known: set of int
+    :return: up to k numbers, fewest edits first, then numerically closest
+    :rtype: list of int
+    """
+    digits = text.strip()
+    if not digits.isdigit():
+        return []
+    typed = int(digits)
+    seen = {digits}
+    frontier = {digits}
+    for _distance in (1, 2):
+        frontier = {variant for s in frontier for variant in _edits(s)} - seen
+        seen |= frontier
+        found = {int(v) for v in frontier if v and int(v) != typed and int(v) in known}
+        if found:
+            return sorted(found, key=lambda nr: abs(nr - typed))[:k]
+    return []
+
+def _edits(s, alphabet=string.digits):
+    """Strings one edit away from s: a character dropped, two swapped,
+    or one of the alphabet replacing one or put in."""
+    for i in range(len(s) + 1):
+        left, right = s[:i], s[i:]
+        if right:
+            yield left + right[1:]
+            if len(right) > 1:
+                yield left + right[1] + right[0] + right[2:]
+        for d in alphabet:
+            if right:
+                yield left + d + right[1:]
+            yield left + d + right
+
+class FuzzyLookup(QObject):
+    """Fuzzy search over one database's SKUs, items and customers.
+
+    The indexes are built in a background thread, cheapest first, so
+    neither startup nor the first keystroke waits for a million item
+    notes to be indexed; until an index is ready its lookups find
+    nothing. Writes made through this process' InventoryDB, and those
+    of other counters published from the change log, update the
+    indexes entry by entry, including changes arriving while a build
+    runs. A reload requested by the ChangeBus only marks them stale;
+    they are then rebuilt in the background, at most once per
+    rebuild_interval seconds, the old ones serving lookups meanwhile.
+    """
+    def __init__(self, db, rebuild_interval=60.0, parent=None) -> None:
+        """Start building the indexes.
+
+        :param db: database to search
+        :type db: InventoryDB
+        :param rebuild_interval: least seconds between rebuilds after external changes
+        :type rebuild_interval: float
+        """
+        super().__init__(parent)
+        self.db = db
+        self.rebuild_interval = rebuild_interval
+        md = db.md
+        self.sources = { # table -> kind, indexed column
+            md.SKUs.table: (SKU, md.SKUs.name.name),
+            md.items.table: (ITEM, md.items.notes.name),
+            md.customers.table: (CUSTOMER, md.customers.name.name),
+        }
+        self.columns = {kind: col for kind, col in self.sources.values()}
+        self.filepath = db.connection_handle().databaseName()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fuzzy-index')
+        self.indexes = {} # kind -> TrigramIndex; NUMBER -> set of inventory numbers
+        self.building = {} # kind -> (Future, [(key, row)] changed since the build started)
+        self.rebuild()
+        if db.bus is not None:
+            db.bus.changed.connect(self.on_change)
+            db.bus.external_change.connect(self.on_external_change)
+    def rebuild(self):
+        """Rebuild the indexes in the background; the current ones serve lookups meanwhile."""
+        for kind in BUILD_ORDER:
+            if kind not in self.building:
+                future = self.executor.submit(
+                    _build_index, self.filepath, f"fuzzy:{id(self)}:{kind}", kind
+                )
+                self.building[kind] = (future, [])
+        self.built = time.monotonic()
+        self.stale = False
+    def close(self):
+        """Drop the builds that haven't started yet and let the thread end."""
+        for future, _changes in self.building.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+    def on_change(self, event):
+        source = self.sources.get(event.table)
+        if source is None:
+            return
+        kind = source[0]
+        row = self.db.record(event.table, event.key)
+        for affected in ((kind, NUMBER) if kind == ITEM else (kind,)):
+            if affected in self.building:
+                self.building[affected][1].append((event.key, row))
+            if affected in self.indexes:
+                self._apply(affected, self.indexes[affected], event.key, row)
+    def on_external_change(self):
+        self.stale = True
+    def SKUs(self, text, k=10):
+        """SKUs whose names resemble a text.
+
+        :return: (sku, name, similarity) tuples, best first
+        :rtype: list
+        """
+        return self._search(SKU, text, k)
+    def items(self, text, k=10):
+        """Items whose notes resemble a text.
+
+        :return: (inv_nr, notes, similarity) tuples, best first
+        :rtype: list
+        """
+        return self._search(ITEM, text, k)
+    def customers(self, text, k=10):
+        """Customers whose names resemble a text.
+
+        :return: (id, name, similarity) tuples, best first
+        :rtype: list
+        """
+        return self._search(CUSTOMER, text, k)
+    def inventory_numbers(self, text, k=5):
+        """Suggestions for a mistyped inventory number.
+
+        :rtype: list of int
+        """
+        known = self._ready(NUMBER)
+        return similar_numbers(text, known, k) if known is not None else []
+    def _search(self, kind, text, k):
+        index = self._ready(kind)
+        return index.search(text, k) if index is not None else []
+    def _ready(self, kind):
+        """A kind's index, once a finished build has been put in place.
+
+        :return: None while the first build runs
+        """
+        self._refresh_if_stale()
+        building = self.building.get(kind)
+        if building is not None and building[0].done():
+            future, changes = self.building.pop(kind)
+            if not future.cancelled() and future.exception() is None:
+                index = future.result()
+                for key, row in changes:
+                    self._apply(kind, index, key, row)
+                self.indexes[kind] = index
+        return self.indexes.get(kind)
+    def _apply(self, kind, index, key, row):
+        if kind == NUMBER:
+            if row is None:
+                index.discard(key)
+            else:
+                index.add(key)
+        elif row is None:
+            index.remove(key)
+        else:
+            index.add(key, row[self.columns[kind]] or '')
+    def _refresh_if_stale(self):
+        if self.stale and time.monotonic() - self.built >= self.rebuild_interval:
+            self.rebuild()
+
+def _build_index(filepath, conn_name, kind):
+    """Runs in the background thread: index one kind through a connection of its own.
+
+    :return: TrigramIndex; for NUMBER, the set of inventory numbers
+    """
+    if open_db(filepath, conn_name) == '':
+        raise OSError(f"open_db({filepath}) failed in the fuzzy index thread")
+    try:
+        db = InventoryDB(conn_name)
+        if kind == NUMBER:
+            index = db.inventory_numbers()
+        else:
+            index = TrigramIndex()
+            for key, text in _texts(db, kind):
+                index.add(key, text)
+        del db # its prepared queries must go before the connection
+    finally:
+        QSqlDatabase.database(conn_name).close()
+        QSqlDatabase.removeDatabase(conn_name)
+    return index
+
+def _texts(db, kind):
+    if kind == SKU:
+        return ((sku, name) for sku, name, _notes in db.search_SKUs(''))
+    if kind == ITEM:
+        return db.item_notes()
+    return ((row[0], row[1]) for row in db.customer_summaries())
@@ -1,55 +1,215 @@
 from PyQt5.QtWidgets import (
-    QWidget, 
-    QGridLayout, 
-    QTableView, 
-    QComboBox, 
-    QLineEdit, 
-    QPushButton
+    QWidget,
+    QGridLayout,
+    QTableView,
+    QComboBox,
+    QLineEdit,
+    QPushButton,
+    QListWidget,
+    QListWidgetItem,
+    QLabel,
+    QSpinBox
 )
+from datetime import datetime, timedelta
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QTimer
 from .item_viewer import InventoryItemViewer
+from .scan_pipeline import ScanPipeline
 
+ACCEPTED_COLOR = QColor('#c8f7c5')
+REJECTED_COLOR = QColor('#f7c5c5')
 
 class CheckInOutFrm(QWidget):
     """Base class for Checkin and Checkout forms.
 
-    Holds widgets that appear in both. 
+    Holds widgets that appear in both. Scanned inventory numbers
+    are collected into a cart which is committed to the database
+    as a single transaction.
     """
 
-    def __init__(self, frm_name="", parent=None) -> None:
+    def __init__(self, frm_name="", db=None, parent=None, lookup=None) -> None:
         """Creates a QWidget and delegates creating widgets to init_widgets
 
-        :param frm_name: Caption that'll appear on buttons & labels; 
+        :param frm_name: Caption that'll appear on buttons & labels;
         tells what the form is doing to the database.
         :type frm_name: str
+        :param db: database the cart is committed to
+        :type db: InventoryDB
         :param parent: Parent QObject that gets passed to the base class QWidget
+        :param lookup: suggests items for rejected scans
+        :type lookup: FuzzyLookup, optional
         """
-        
+
         super().__init__(parent)
+        self.db = db
+        self.lookup = lookup
         self.layout = self._init_widgets(frm_name)
+        self.out_nrs = set() # items checked out, kept current from the ChangeBus
+        self.scanner = ScanPipeline(self.inv_no_input, parent=self, check=self.check_scan)
+        if db is not None:
+            self.refresh_known_items()
+            if db.bus is not None:
+                db.bus.changed.connect(self.on_item_change)
+                db.bus.external_change.connect(self.refresh_known_items)
+        self._connect_slots()
     def _init_widgets(self, frm_name):
         """Draws widgets
-        
+
         :param frm_name: Button & label caption: what the form is doing
         :type frm_name: str
         """
         lay = QGridLayout(self)
         self.inv_no_input = QLineEdit()
-        self.inv_no_input.setText('inventory number')
+        self.inv_no_input.setPlaceholderText('inventory number')
         self.inv_no_enter = QPushButton(frm_name)
+        self.scan_feedback = QLabel()
+        self.cart_view = QListWidget()
         self.hist_view = QTableView()
         self.hist_item_viewer = InventoryItemViewer()
         #addWidget(widget: QWidget, row: int, col: int, [rowSpan, colSpan, alignment])
         lay.addWidget(self.inv_no_input, 1, 0)
         lay.addWidget(self.inv_no_enter, 1, 1)
-        lay.addWidget(self.hist_view, 2, 0, 1, 2)
-        lay.addWidget(self.hist_item_viewer, 3, 0, 1, 2)
+        lay.addWidget(self.scan_feedback, 2, 0, 1, 2)
+        lay.addWidget(self.cart_view, 3, 0, 1, 2)
+        lay.addWidget(self.hist_view, 4, 0, 1, 2)
+        lay.addWidget(self.hist_item_viewer, 5, 0, 1, 2)
         return lay
+    def _connect_slots(self):
+        self.scanner.accepted.connect(self.on_scan_accepted)
+        self.scanner.rejected.connect(self.on_scan_rejected)
+        self.scanner.batch_done.connect(self.cart_view.scrollToBottom)
+        self.inv_no_enter.clicked.connect(self.on_commit)
+        self.cart_view.itemDoubleClicked.connect(self.on_cart_item_removed)
+    def refresh_known_items(self):
+        """Reload the inventory numbers scans are validated against."""
+        self.scanner.set_known_nrs(self.db.inventory_numbers())
+        self.out_nrs = self.db.out_inventory_numbers()
+    def on_item_change(self, event):
+        """Follow added items and moves, so that scans are checked against the current state."""
+        md = self.db.md
+        if event.table == md.items.table:
+            if self.db.record(event.table, event.key) is None:
+                self.scanner.known_nrs.discard(event.key)
+            else:
+                self.scanner.known_nrs.add(event.key)
+        elif event.table in (md.checkins.table, md.checkouts.table):
+            row = self.db.record(event.table, event.key)
+            if row is None:
+                return
+            if event.table == md.checkouts.table:
+                self.out_nrs.add(row[md.checkouts.inv_nr.name])
+            else:
+                self.out_nrs.discard(row[md.checkins.inv_nr.name])
+    def check_scan(self, nr) -> str:
+        """Why a known item can't go into this form's cart, '' if it can.
+
+        Implemented by subclasses.
+        """
+        return ''
+    def on_scan_accepted(self, nr):
+        item = QListWidgetItem(str(nr), self.cart_view)
+        item.setBackground(ACCEPTED_COLOR)
+        self._show_feedback(f"{nr}: added, {len(self.scanner.cart)} in cart", ACCEPTED_COLOR)
+    def on_scan_rejected(self, text, reason):
+        suggestions = self._suggestions(text) if reason != "already in cart" else ''
+        self._show_feedback(f"{text}: {reason}{suggestions}", REJECTED_COLOR)
+    def _suggestions(self, text):
+        """', did you mean ...?' for a mistyped number or a typed description."""
+        if self.lookup is None:
+            return ''
+        if text.isdigit():
+            candidates = [str(nr) for nr in self.lookup.inventory_numbers(text, 3)]
+        else:
+            candidates = [f"{nr} ({notes})" for nr, notes, _sim in self.lookup.items(text, 3)]
+        return f", did you mean {', '.join(candidates)}?" if candidates else ''
+    def on_cart_item_removed(self, item):
+        self.scanner.remove(int(item.text()))
+        self.cart_view.takeItem(self.cart_view.row(item))
+    def on_commit(self):
+        if not self.scanner.submit_current():
+            return # the rejection is on display; let the user fix it first
+        if not self.scanner.cart:
+            self._show_feedback("cart is empty", REJECTED_COLOR)
+        elif self.commit_cart(list(self.scanner.cart)):
+            self._show_feedback(f"{len(self.scanner.cart)} items saved", ACCEPTED_COLOR)
+            self.scanner.clear()
+            self.cart_view.clear()
+        else:
+            self._show_feedback(f"nothing saved: {self._rejection(self.scanner.cart)}", REJECTED_COLOR)
+    def _rejection(self, nrs):
+        """Tell which items made the database reject a cart.
+
+        Another counter may have moved them since they were scanned.
+        """
+        self.refresh_known_items()
+        problems = []
+        for nr in nrs:
+            reason = "unknown item" if nr not in self.scanner.known_nrs else self.check_scan(nr)
+            if reason:
+                problems.append(f"{nr} {reason}")
+        if problems:
+            return ', '.join(problems)
+        error = self.db.last_error
+        return error.text() if error is not None else "the database rejected the cart"
+    def commit_cart(self, nrs) -> bool:
+        """Write the cart to the database, all or nothing.
+
+        Implemented by subclasses.
+        """
+        return False
+    def _show_feedback(self, text, color):
+        self.scan_feedback.setText(text)
+        self.inv_no_input.setStyleSheet(f"background-color: {color.name()}")
 
 class CheckInFrm(CheckInOutFrm):
-    def __init__(self, parent=None) -> None:
-        CheckInOutFrm.__init__(self, frm_name="Checkin")
+    def __init__(self, db=None, parent=None, lookup=None) -> None:
+        CheckInOutFrm.__init__(self, frm_name="Checkin", db=db, parent=parent, lookup=lookup)
+    def check_scan(self, nr) -> str:
+        return "not checked out" if nr not in self.out_nrs else ''
+    def commit_cart(self, nrs) -> bool:
+        return self.db.checkin_many(nrs)
 class CheckOutFrm(CheckInOutFrm):
-    def __init__(self, parent=None) -> None:
-        CheckInOutFrm.__init__(self, frm_name="Checkout")
-        client_selector = QComboBox()
-        self.layout.addWidget(client_selector, 0, 0, 1, 2)
\ No newline at end of file
+    def __init__(self, db=None, parent=None, lookup=None) -> None:
+        CheckInOutFrm.__init__(self, frm_name="Checkout", db=db, parent=parent, lookup=lookup)
+        self.client_selector = QComboBox()
+        self.rental_days = QSpinBox()
+        self.rental_days.setRange(1, 365)
+        self.rental_days.setSuffix(" days")
+        self.layout.addWidget(self.client_selector, 0, 0)
+        self.layout.addWidget(self.rental_days, 0, 1)
+        # a burst of moves refreshes the picker once
+        self.clients_timer = QTimer(self)
+        self.clients_timer.setSingleShot(True)
+        self.clients_timer.timeout.connect(self.refresh_clients)
+        if db is not None:
+            self.refresh_clients()
+            if db.bus is not None:
+                db.bus.changed.connect(self.on_change)
+                db.bus.external_change.connect(self.clients_timer.start)
+    def check_scan(self, nr) -> str:
+        return "already checked out" if nr in self.out_nrs else ''
+    def on_change(self, event):
+        md = self.db.md
+        if event.table in (md.customers.table, md.checkins.table, md.checkouts.table):
+            self.clients_timer.start()
+    def refresh_clients(self):
+        """Fill the client picker from the customer summaries, keeping the selection."""
+        selected = self.client_selector.currentData()
+        self.client_selector.clear()
+        for customer_id, name, items_out, _rentals, overdue in self.db.customer_summaries():
+            label = f"{name} ({items_out} out, {overdue} overdue)" if overdue else f"{name} ({items_out} out)"
+            self.client_selector.addItem(label, customer_id)
+        if selected is not None:
+            self.client_selector.setCurrentIndex(self.client_selector.findData(selected))
+    def on_commit(self):
+        if self.client_selector.currentData() is None:
+            self._show_feedback("select a client first", REJECTED_COLOR)
+        else:
+            super().on_commit()
+    def commit_cart(self, nrs) -> bool:
+        due = datetime.now() + timedelta(days=self.rental_days.value())
+        return self.db.checkout_many(
+            nrs,
+            self.client_selector.currentData(),
+            due.isoformat(sep=' ', timespec='seconds')
+        )
\ No newline at end of file
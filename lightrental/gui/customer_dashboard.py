@@ -0,0 +1,89 @@
+from PyQt5.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QLabel,
+    QTableWidget,
+    QTableWidgetItem,
+    QAbstractItemView
+)
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QColor
+
+OVERDUE_COLOR = QColor('#f7c5c5')
+
+class CustomerDashboard(QWidget):
+    """Customers with their rental counts, plus the items
+    the selected customer currently has.
+
+    Everything shown comes from the per-customer summary tables,
+    so opening or refreshing the dashboard doesn't scan the history.
+    """
+    customer_headers = ['name', 'items out', 'overdue', 'lifetime rentals']
+    item_headers = ['inv. number', 'SKU', 'out since', 'due']
+
+    def __init__(self, db, parent=None) -> None:
+        """
+        :param db: database SQL wrapper object
+        :type db: InventoryDB
+        """
+        super().__init__(parent)
+        self.db = db
+        self._init_widgets()
+        self.customers.itemSelectionChanged.connect(self.on_customer_selected)
+        # a burst of moves refreshes the dashboard once
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self.refresh)
+        if self.db.bus is not None:
+            self.db.bus.changed.connect(self.on_change)
+            self.db.bus.external_change.connect(self.refresh_timer.start)
+        self.refresh()
+    def _init_widgets(self):
+        lay = QVBoxLayout(self)
+        self.customers = self._make_table(self.customer_headers)
+        self.items = self._make_table(self.item_headers)
+        lay.addWidget(QLabel("Customers"))
+        lay.addWidget(self.customers)
+        lay.addWidget(QLabel("Items out"))
+        lay.addWidget(self.items)
+        self.setWindowTitle("Customers")
+    def _make_table(self, headers):
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setSelectionMode(QAbstractItemView.SingleSelection)
+        return table
+    def on_change(self, event):
+        md = self.db.md
+        if event.table in (md.customers.table, md.checkins.table, md.checkouts.table):
+            self.refresh_timer.start()
+    def refresh(self):
+        """Reload the customer list, keeping the selection."""
+        selected = self.selected_customer()
+        summaries = self.db.customer_summaries()
+        self.customers.setRowCount(len(summaries))
+        for row, (customer_id, name, items_out, rentals, overdue) in enumerate(summaries):
+            name_item = QTableWidgetItem(name)
+            name_item.setData(Qt.UserRole, customer_id)
+            self.customers.setItem(row, 0, name_item)
+            for col, value in enumerate((items_out, overdue, rentals), start=1):
+                self.customers.setItem(row, col, QTableWidgetItem(str(value)))
+            if overdue:
+                for col in range(len(self.customer_headers)):
+                    self.customers.item(row, col).setBackground(OVERDUE_COLOR)
+            if customer_id == selected:
+                self.customers.selectRow(row)
+        self.on_customer_selected()
+    def selected_customer(self):
+        rows = self.customers.selectionModel().selectedRows()
+        if not rows:
+            return None
+        return self.customers.item(rows[0].row(), 0).data(Qt.UserRole)
+    def on_customer_selected(self):
+        customer_id = self.selected_customer()
+        items = self.db.items_out(customer_id) if customer_id is not None else []
+        self.items.setRowCount(len(items))
+        for row, values in enumerate(items):
+            for col, value in enumerate(values):
+                self.items.setItem(row, col, QTableWidgetItem('' if value is None else str(value)))
@@ -5,17 +5,21 @@ from PyQt5.QtWidgets import (
     QVBoxLayout, 
     QGridLayout, 
     QPushButton,
-    QLabel
+    QLabel,
+    QCompleter
 )
+from PyQt5.QtCore import QStringListModel
 from .item_viewer import InventoryItemViewer
 
 class InventoryFrm(QWidget):
-    def __init__(self, parent=None) -> None:
+    def __init__(self, model, parent=None, lookup=None) -> None:
         super().__init__(parent)
+        self.model = model
+        self.lookup = lookup
         self.init_widgets()
     def init_widgets(self):
         layout = QVBoxLayout(self)
-        inventory_view = InventoryView()
+        inventory_view = InventoryView(self.model, lookup=self.lookup)
         item_viewer = InventoryItemViewer()
         layout.addWidget(inventory_view)
         layout.addWidget(item_viewer)
@@ -28,10 +32,13 @@ class InventoryView(QWidget):
     This class abstracts away the actual view widgets and 
     their directly related editing controls from the inventory form. 
     """
-    def __init__(self, model, parent=None) -> None:
+    def __init__(self, model, parent=None, lookup=None) -> None:
         super().__init__(parent)
         self.init_widgets()
         self.model = model
+        self.lookup = lookup
+        if lookup is not None:
+            self.init_SKU_completer()
     def init_widgets(self):
         #buttons related to viewer widget
         self.layout = QGridLayout()
@@ -72,6 +79,20 @@ class InventoryView(QWidget):
         self.itm_deletion_hint.setWordWrap(1)
         self.layout.addWidget(self.itm_deletion_hint, 6, 1, 1, 2)
         self.setLayout(self.layout)
+    def init_SKU_completer(self):
+        """Offer the SKUs closest to what's typed into the SKU search,
+        typos included."""
+        self.SKU_suggestions = QStringListModel(self)
+        completer = QCompleter(self.SKU_suggestions, self)
+        # the lookup already picked the candidates, don't filter by prefix
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.search_SKUs_input.setCompleter(completer)
+        self.search_SKUs_input.textEdited.connect(self.on_SKU_search_edited)
+    def on_SKU_search_edited(self, text):
+        found = self.lookup.SKUs(text, 10) if text.strip() else []
+        self.SKU_suggestions.setStringList([name for _sku, name, _sim in found])
+        if found:
+            self.search_SKUs_input.completer().complete()
     def set_model(table_model, category_col_id, SKU_col_id):
         """Connect the view to a flat table model.
 
@@ -7,6 +7,12 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtGui import QKeySequence
 from .checkinout_frm import CheckInFrm, CheckOutFrm
 from .inventory_frm import InventoryFrm
+from .customer_dashboard import CustomerDashboard
+from ..datamodel import HistoryModel
+try:
+    from ..fuzzy import FuzzyLookup
+except ImportError: # numpy missing: no typo-tolerant search
+    FuzzyLookup = None
 
 class MainWnd(QMainWindow):
     def __init__(self, model) -> None:
@@ -29,9 +35,13 @@ class MainWnd(QMainWindow):
         self.main_widget = QWidget() # central widget of MainWnd's implicit layout
         layout = QHBoxLayout(self.main_widget)
         # our layout resides inside mainWidget => it'll be the parent
-        self.checkin_frm = CheckInFrm()
-        self.checkout_frm = CheckOutFrm()
-        self.inventory_frm = InventoryFrm(self.model)
+        self.lookup = FuzzyLookup(self.model.db, parent=self) if FuzzyLookup is not None else None
+        self.checkin_frm = CheckInFrm(self.model.db, lookup=self.lookup)
+        self.checkout_frm = CheckOutFrm(self.model.db, lookup=self.lookup)
+        md = self.model.db.md
+        self.checkin_frm.hist_view.setModel(HistoryModel(self.model.db, md.checkins.table, self))
+        self.checkout_frm.hist_view.setModel(HistoryModel(self.model.db, md.checkouts.table, self))
+        self.inventory_frm = InventoryFrm(self.model, lookup=self.lookup)
         layout.addWidget(self.checkin_frm)
         layout.addWidget(self.inventory_frm)
         layout.addWidget(self.checkout_frm)
@@ -42,11 +52,20 @@ class MainWnd(QMainWindow):
         self.search_hist_action.setShortcut('Ctrl+H')
         self.save_history_action = QAction("Save History to a File", self)
         self.about_LR_action = QAction("About LightRental", self)
+        self.customers_action = QAction("Customer Dashboard", self)
+        self.customers_action.triggered.connect(self.show_customer_dashboard)
+    def show_customer_dashboard(self):
+        if not hasattr(self, 'customer_dashboard'):
+            self.customer_dashboard = CustomerDashboard(self.model.db)
+        self.customer_dashboard.show()
+        self.customer_dashboard.raise_()
     def _init_menu_bar(self):
         menu_bar = self.menuBar()
         self.hist_menu = menu_bar.addMenu("&History")
         self.hist_menu.addAction(self.search_hist_action)
         self.hist_menu.addAction(self.save_history_action)
+        self.customers_menu = menu_bar.addMenu("&Customers")
+        self.customers_menu.addAction(self.customers_action)
         self.about_menu = menu_bar.addMenu("&About")
         self.about_menu.addAction(self.about_LR_action)
     
\ No newline at end of file
@@ -0,0 +1,99 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+class ScanPipeline(QObject):
+    """Turns barcode/QR scanner input in a QLineEdit into a cart of
+    validated inventory numbers.
+
+    USB scanners type a whole code within a few milliseconds and end it
+    with Enter. While a burst is in progress the line edit's repaints
+    are suspended; scans finished meanwhile are queued and validated
+    as one batch once the input has been quiet for debounce_ms, so the
+    cart view is redrawn once per batch instead of once per keystroke.
+    """
+    accepted = pyqtSignal(int) # inventory number added to the cart
+    rejected = pyqtSignal(str, str) # scanned text, reason
+    batch_done = pyqtSignal() # a batch of scans has been processed
+
+    def __init__(self, line_edit, known_nrs=(), debounce_ms=40, parent=None, check=None) -> None:
+        """Attach the pipeline to a line edit.
+
+        :param line_edit: where the scanner types
+        :type line_edit: QLineEdit
+        :param known_nrs: inventory numbers a scan is validated against
+        :type known_nrs: iterable of int
+        :param debounce_ms: quiet time ending a burst of keystrokes
+        :type debounce_ms: int
+        :param check: validates a known item further, e.g. that it is out;
+        returns why the scan is rejected, '' if it isn't
+        :type check: callable, optional
+        """
+        super().__init__(parent)
+        self.line_edit = line_edit
+        self.known_nrs = set(known_nrs)
+        self.check = check
+        self.cart = [] # inventory numbers in scan order
+        self.pending = [] # scanned but not yet validated texts
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce_ms)
+        self.timer.timeout.connect(self.flush)
+        self.line_edit.textEdited.connect(self.on_text_edited)
+        self.line_edit.returnPressed.connect(self.on_return_pressed)
+    def set_known_nrs(self, nrs):
+        self.known_nrs = set(nrs)
+    def on_text_edited(self, _text):
+        if self.line_edit.updatesEnabled():
+            self.line_edit.setUpdatesEnabled(False)
+        self.timer.start()
+    def on_return_pressed(self):
+        text = self.line_edit.text().strip()
+        self.line_edit.clear()
+        if text:
+            self.pending.append(text)
+        self.timer.start()
+    def submit_current(self) -> bool:
+        """Queue what the line edit holds, ended with Enter or not, and
+        validate the queue, e.g. before the cart is committed.
+
+        :return: whether every queued scan made it into the cart
+        :rtype: bool
+        """
+        self.on_return_pressed()
+        return self.flush()
+    def flush(self) -> bool:
+        """Validate the queued scans and repaint once.
+
+        :return: whether every queued scan made it into the cart
+        :rtype: bool
+        """
+        self.timer.stop()
+        pending, self.pending = self.pending, []
+        in_cart = set(self.cart)
+        accepted = 0
+        for text in pending:
+            try:
+                nr = int(text)
+            except ValueError:
+                self.rejected.emit(text, "not an inventory number")
+                continue
+            reason = self.check(nr) if self.check is not None and nr in self.known_nrs else ''
+            if nr not in self.known_nrs:
+                self.rejected.emit(text, "unknown item")
+            elif nr in in_cart:
+                self.rejected.emit(text, "already in cart")
+            elif reason:
+                self.rejected.emit(text, reason)
+            else:
+                in_cart.add(nr)
+                self.cart.append(nr)
+                self.accepted.emit(nr)
+                accepted += 1
+        self.line_edit.setUpdatesEnabled(True)
+        if pending:
+            self.batch_done.emit()
+        return accepted == len(pending)
+    def remove(self, nr):
+        self.cart.remove(nr)
+    def clear(self):
+        self.pending = []
+        self.cart = []
@@ -0,0 +1,285 @@
+"""
+LightRental integrity checker.
+
+Finds dangling foreign keys and unmatched checkout/checkin pairs.
+Each check is a single set-based query whose results are streamed
+with a forward-only cursor, so memory use doesn't grow with the
+history and multi-million-row files are checked in seconds.
+
+Within one file inventory numbers can't repeat - inv_nr is the
+primary key - but across the depots of a ShardedInventoryDB they can;
+check_shards finds those and items stored in a depot whose range
+doesn't own them, with the other depot files attached to the first
+one's connection, so that it is a GROUP BY over their inventories.
+SQLite attaches at most ten files per connection, one of them the
+history archive, so up to ten depots are checked at once.
+
+Repair never deletes anything, as history is append-only: missing
+parent rows (items, SKUs, categories, customers) are recreated as
+placeholders, in chunked transactions so that a long repair doesn't
+hold the write lock for its whole duration. Which relations to repair
+and what to insert follows from the metadata's Relations. Unmatched pairs are only
+reported - which record is wrong is for an operator to decide.
+"""
+
+from collections import namedtuple
+from os import path
+from urllib.parse import quote
+from PyQt5.QtSql import QSqlQuery
+from .database import history_view
+
+Problem = namedtuple(
+    "Problem",
+    ['kind', 'table', 'key', 'detail']
+)
+
+DANGLING = 'dangling reference'
+UNMATCHED = 'unmatched checkin/checkout'
+DUPLICATE = 'duplicate inventory number'
+MISPLACED = "item outside its depot's range"
+
+RECOVERED_NOTE = 'recreated by integrity repair'
+RECOVERED_KEY = -1 # SKU and category of recreated items
+DEPOT_SCHEMA = 'depot' # other depots are attached as depot1, depot2...
+
+def repairs(md):
+    """The relations to repair, in order: (child table, FK column, parent table).
+
+    Children come before their parents, as recreated rows point to
+    RECOVERED_KEY, which is then recreated in turn.
+
+    :type md: InventoryMetadata
+    :rtype: list
+    """
+    tables = md.tables()
+    referrers = {
+        table.table: {
+            child.table for child in tables if child is not table
+            for col in child.columns() if col.relation is not None and col.relation.table == table.table
+        }
+        for table in tables
+    }
+    ordered = []
+    while len(ordered) < len(tables):
+        done = {table.table for table in ordered}
+        ready = [t for t in tables if t not in ordered and referrers[t.table] <= done]
+        ordered += ready or [t for t in tables if t not in ordered] # no cycles, but never loop
+    return [
+        (child, col, md.table(col.relation.table))
+        for child in ordered for col in child.columns() if col.relation is not None
+    ]
+
+def placeholder_sql(parent) -> str:
+    """INSERT recreating a parent table's rows keyed by temp.missing(key).
+
+    Foreign keys point to RECOVERED_KEY, the first required text
+    column names the row, other required columns get empty values and
+    the notes, if the table has them, say where the row came from.
+    """
+    key = parent.key()
+    notes = getattr(parent, 'notes', None)
+    names, values = [key.name], ['key']
+    labelled = False
+    for col in parent.columns()[1:]:
+        required = 'NOT NULL' in col.sql_col_constraint and 'DEFAULT' not in col.sql_col_constraint
+        if col.relation is not None:
+            value = str(RECOVERED_KEY)
+        elif col is notes:
+            value = ':note'
+        elif not required:
+            continue
+        elif col.sql_type == 'TEXT' and not labelled:
+            value = f"'recovered {parent.table} row ' || key"
+            labelled = True
+        else:
+            value = "''" if col.sql_type == 'TEXT' else '0'
+        names.append(col.name)
+        values.append(value)
+    return f"INSERT INTO {parent.table} ({', '.join(names)}) SELECT {', '.join(values)} FROM temp.missing"
+
+class IntegrityChecker:
+    """Runs integrity checks and repairs on one LightRental database."""
+    def __init__(self, db) -> None:
+        """
+        :param db: database to check
+        :type db: InventoryDB
+        """
+        self.db = db
+    def check(self, report=None):
+        """Run all checks.
+
+        :param report: called with each Problem found, e.g. print
+        :type report: callable, optional
+        :return: number of problems of each kind
+        :rtype: dict
+        """
+        counts = {DANGLING: 0, UNMATCHED: 0}
+        for check in (self.dangling_references, self.unmatched_moves):
+            for problem in check():
+                counts[problem.kind] += 1
+                if report is not None:
+                    report(problem)
+        return counts
+    def dangling_references(self):
+        """Yield rows whose foreign keys point nowhere."""
+        query = self._forward_query("PRAGMA foreign_key_check")
+        while query.next():
+            yield Problem(
+                DANGLING, query.value(0), query.value(1),
+                f"references a missing {query.value(2)} row"
+            )
+    def unmatched_moves(self):
+        """Yield checkins not preceded by a checkout and repeated checkouts.
+
+        Every item's moves must alternate out/in, archived ones
+        included. Moves within the same second are ordered checkout first.
+        """
+        md = self.db.md
+        query = self._forward_query(
+            "WITH moves AS ("
+            f" SELECT inv_nr, time, id, 1 AS is_out FROM {history_view(md.checkouts.table)}"
+            " UNION ALL"
+            f" SELECT inv_nr, time, id, 0 AS is_out FROM {history_view(md.checkins.table)}"
+            "), ordered AS ("
+            " SELECT inv_nr, time, id, is_out,"
+            " LAG(is_out) OVER ("
+            "  PARTITION BY inv_nr ORDER BY time, is_out DESC, id"
+            " ) AS prev_is_out"
+            " FROM moves"
+            ") "
+            "SELECT inv_nr, time, id, is_out FROM ordered "
+            "WHERE (is_out = 1 AND prev_is_out = 1) "
+            "OR (is_out = 0 AND (prev_is_out IS NULL OR prev_is_out = 0))"
+        )
+        while query.next():
+            is_out = query.value(3) == 1
+            yield Problem(
+                UNMATCHED,
+                md.checkouts.table if is_out else md.checkins.table,
+                query.value(2),
+                f"item {query.value(0)} at {query.value(1)}: "
+                + ("checked out twice" if is_out else "checked in while not out")
+            )
+    def repair(self, chunk_size=10000):
+        """Recreate missing parent rows as placeholders.
+
+        Missing keys of each relation are collected into a temp table in
+        one pass, then inserted chunk_size rows per transaction.
+        FK enforcement is suspended meanwhile, since recreated items
+        reference a recreated SKU and category.
+
+        :param chunk_size: rows per transaction
+        :type chunk_size: int
+        :return: number of rows recreated in each parent table
+        :rtype: dict
+        """
+        handle = self.db.connection_handle()
+        query = QSqlQuery(handle)
+        query.exec("PRAGMA foreign_keys = OFF")
+        recreated = {}
+        try:
+            for child, col, parent in repairs(self.db.md):
+                recreated[parent.table] = recreated.get(parent.table, 0) + self._recreate_parents(
+                    handle, child.table, col.name, parent, chunk_size
+                )
+        finally:
+            query.exec("PRAGMA foreign_keys = ON")
+            query.finish()
+        return recreated
+    def _recreate_parents(self, handle, child, col, parent, chunk_size):
+        key = parent.key().name
+        insert_sql = placeholder_sql(parent)
+        query = QSqlQuery(handle)
+        query.exec("DROP TABLE IF EXISTS temp.missing")
+        query.exec(
+            f"CREATE TEMP TABLE missing AS SELECT DISTINCT c.{col} AS key "
+            f"FROM {child} c WHERE c.{col} IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM {parent.table} p WHERE p.{key} = c.{col})"
+        )
+        query.exec("SELECT MAX(rowid) FROM temp.missing")
+        last = query.value(0) if query.next() else None
+        query.finish()
+        inserted = 0
+        lo = 0
+        while last and lo < last:
+            if not handle.transaction():
+                break
+            query.prepare(f"{insert_sql} WHERE rowid > :lo AND rowid <= :hi")
+            query.bindValue(":note", RECOVERED_NOTE)
+            query.bindValue(":lo", lo)
+            query.bindValue(":hi", lo + chunk_size)
+            if not query.exec():
+                query.finish()
+                handle.rollback()
+                break
+            inserted += query.numRowsAffected()
+            query.finish()
+            handle.commit()
+            lo += chunk_size
+        query.exec("DROP TABLE temp.missing")
+        query.finish()
+        return inserted
+    def _forward_query(self, sql):
+        query = QSqlQuery(self.db.connection_handle())
+        query.setForwardOnly(True)
+        query.exec(sql)
+        return query
+
+def check_shards(sharded, report=None):
+    """Check that every inventory number is stored once, in the depot owning it.
+
+    :param sharded: depots to check
+    :type sharded: ShardedInventoryDB
+    :param report: called with each Problem found, e.g. print
+    :type report: callable, optional
+    :return: number of problems of each kind
+    :rtype: dict
+    """
+    counts = {DUPLICATE: 0, MISPLACED: 0}
+    for problem in shard_problems(sharded):
+        counts[problem.kind] += 1
+        if report is not None:
+            report(problem)
+    return counts
+
+def shard_problems(sharded):
+    """Yield items stored in the wrong depot, then inventory numbers stored in several."""
+    items = sharded.md.items
+    handle = sharded.dbs[sharded.shards[0].location].connection_handle()
+    schemas = ['main'] + [f"{DEPOT_SCHEMA}{n}" for n in range(1, len(sharded.shards))]
+    query = QSqlQuery(handle)
+    query.setForwardOnly(True)
+    try:
+        for schema, shard in zip(schemas[1:], sharded.shards[1:]):
+            query.prepare(f"ATTACH DATABASE :depot AS {schema}")
+            query.bindValue(":depot", f"file:{quote(path.abspath(shard.filepath))}?mode=ro")
+            if not query.exec():
+                raise OSError(f"can't attach {shard.filepath}: {query.lastError().text()}")
+        for schema, shard in zip(schemas, sharded.shards):
+            query.prepare(
+                f"SELECT {items.inv_nr.name} FROM {schema}.{items.table} "
+                f"WHERE {items.inv_nr.name} NOT BETWEEN :first AND :last ORDER BY {items.inv_nr.name}"
+            )
+            query.bindValue(":first", shard.inv_nrs.start)
+            query.bindValue(":last", shard.inv_nrs.stop - 1)
+            query.exec()
+            while query.next():
+                yield Problem(MISPLACED, items.table, query.value(0), f"stored in {shard.location}")
+        stored = ' UNION ALL '.join(
+            f"SELECT :location{n} AS location, {items.inv_nr.name} AS inv_nr FROM {schema}.{items.table}"
+            for n, schema in enumerate(schemas)
+        )
+        query.prepare(
+            f"SELECT inv_nr, group_concat(location, ', ') FROM ({stored}) "
+            "GROUP BY inv_nr HAVING COUNT(*) > 1 ORDER BY inv_nr"
+        )
+        for n, shard in enumerate(sharded.shards):
+            query.bindValue(f":location{n}", shard.location)
+        query.exec()
+        while query.next():
+            yield Problem(DUPLICATE, items.table, query.value(0), f"stored in {query.value(1)}")
+    finally:
+        query.finish()
+        for schema in schemas[1:]:
+            query.exec(f"DETACH DATABASE {schema}")
+        query.finish()
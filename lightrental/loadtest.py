@@ -0,0 +1,375 @@
+"""
+LightRental load test.
+
+Simulates many counters working on one inventory file at once: each
+counter is a separate process with its own connection, opened through
+open_db, running a mix of checkouts, checkins, SKU searches and
+history reads at a target rate. The report gives throughput, latency
+percentiles and how often SQLITE_BUSY forced a retry, so journal
+mode, synchronous, busy timeout, group commit (items per transaction)
+and connection pooling can be compared on one machine.
+
+Workers warm up (open the file, learn which items they move) at their
+own pace and report ready; the measured period starts once all of
+them are, and throughput is divided by the time actually measured.
+
+The test writes checkins and checkouts, so by default it runs on a
+copy of the file.
+"""
+
+import os
+import random
+import tempfile
+import time
+import multiprocessing
+from queue import Empty
+from collections import namedtuple
+from dataclasses import dataclass, field
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtSql import QSqlDatabase
+from .database import InventoryDB, open_db
+
+CHECKOUT = 'checkout'
+CHECKIN = 'checkin'
+SEARCH = 'search'
+HISTORY = 'history'
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+@dataclass
+class LoadTestConfig:
+    workers: int = 4 # simulated counters, one process each
+    rate: float = 50.0 # target operations per second, all workers together
+    duration: float = 30.0 # seconds of measured load
+    mix: dict = field(default_factory=lambda: {
+        CHECKOUT: 0.3, CHECKIN: 0.3, SEARCH: 0.3, HISTORY: 0.1
+    }) # operation -> share of the load
+    journal_mode: str = 'WAL' # set once on the file before the test
+    synchronous: str = 'NORMAL'
+    busy_timeout: int = 5000 # ms SQLite waits for a lock before SQLITE_BUSY
+    group_commit: int = 1 # items moved per checkin/checkout transaction
+    pooled: bool = True # keep one connection per worker instead of one per operation
+    max_retries: int = 10 # per operation, after SQLITE_BUSY
+    startup: float = 120.0 # most seconds the workers get to open and warm up
+    grace: float = 60.0 # most seconds past the measured period a worker may take to report
+
+OpStats = namedtuple(
+    "OpStats",
+    ['op', 'count', 'failed', 'p50', 'p90', 'p99', 'max'] # latencies in ms
+)
+
+LoadTestReport = namedtuple(
+    "LoadTestReport",
+    ['config', 'elapsed', 'throughput', 'busy_retries', 'ops',
+     'start_lag'] # s the latest worker's first operation ran behind schedule
+)
+
+LATE_START = 0.1 # s of start lag worth a warning
+
+def run_load_test(filepath, config, copy=True) -> LoadTestReport:
+    """Run a load test against an inventory file.
+
+    :param filepath: inventory file with items and customers to move around
+    :type filepath: path
+    :param config: workload and settings to test
+    :type config: LoadTestConfig
+    :param copy: test on a temporary copy, leaving the file untouched
+    :type copy: bool
+    :return: the results, or None if the file couldn't be opened or copied,
+    a worker failed to warm up within config.startup (e.g. the file has
+    no customers, or no items for it) or failed or hung during the test
+    :rtype: LoadTestReport
+    """
+    with tempfile.TemporaryDirectory(prefix='lightrental-load-') as tmpdir:
+        if copy:
+            target = os.path.join(tmpdir, os.path.basename(filepath))
+            conn_name = open_db(filepath, 'loadtest:source')
+            if conn_name == '':
+                return None
+            ok = InventoryDB(conn_name).copy_to(target)
+            _drop_connection(conn_name)
+            if not ok:
+                return None
+        else:
+            target = filepath
+        # journal_mode is stored in the file; set it before any worker connects
+        conn_name = open_db(target, 'loadtest:setup', {'journal_mode': config.journal_mode})
+        if conn_name == '':
+            return None
+        _drop_connection(conn_name)
+        return _run_workers(target, config)
+
+def _run_workers(filepath, config):
+    ctx = multiprocessing.get_context('spawn') # no Qt state inherited by forking
+    ready = ctx.Queue()
+    start = ctx.Queue()
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=_worker,
+            args=(filepath, config, index, ready, start, results),
+            name=f"counter-{index}"
+        )
+        for index in range(config.workers)
+    ]
+    for proc in procs:
+        proc.start()
+    if _collect(procs, ready, time.time() + config.startup) is None:
+        _stop(procs)
+        return None
+    # everybody is warm: a common start shortly ahead
+    start_at = time.time() + 0.2
+    for _proc in procs:
+        start.put(start_at)
+    collected = _collect(procs, results, start_at + config.duration + config.grace)
+    if collected is None:
+        _stop(procs)
+        return None
+    for proc in procs:
+        proc.join()
+    latencies = {op: [] for op in config.mix}
+    failed = {op: 0 for op in config.mix}
+    busy_retries = 0
+    ended = start_at
+    start_lag = 0.0
+    for worker_latencies, worker_failed, worker_busy, worker_lag, worker_end in collected:
+        for op in config.mix:
+            latencies[op].extend(worker_latencies[op])
+            failed[op] += worker_failed[op]
+        busy_retries += worker_busy
+        start_lag = max(start_lag, worker_lag)
+        ended = max(ended, worker_end)
+    done = sum(len(values) for values in latencies.values())
+    elapsed = ended - start_at
+    return LoadTestReport(
+        config, elapsed, done / elapsed if elapsed > 0 else 0.0, busy_retries,
+        [_op_stats(op, latencies[op], failed[op]) for op in config.mix],
+        start_lag
+    )
+
+def _collect(procs, messages, deadline):
+    """Wait for a message from every worker: ready, or its results.
+
+    :return: what the workers sent; None as soon as one reports an
+    error or dies without reporting, or when the deadline passes
+    :rtype: list
+    """
+    collected = {}
+    while len(collected) < len(procs):
+        try:
+            index, error, payload = messages.get(timeout=max(0.0, min(1.0, deadline - time.time())))
+        except Empty:
+            died = any(
+                proc.exitcode is not None and index not in collected
+                for index, proc in enumerate(procs)
+            )
+            if died or time.time() >= deadline:
+                return None
+            continue
+        if error is not None:
+            return None
+        collected[index] = payload
+    return list(collected.values())
+
+def _stop(procs):
+    for proc in procs:
+        proc.terminate()
+        proc.join()
+
+def _op_stats(op, latencies, failed):
+    latencies.sort()
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return 1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    return OpStats(
+        op, len(latencies), failed,
+        percentile(0.5), percentile(0.9), percentile(0.99), percentile(1.0)
+    )
+
+def format_report(report) -> str:
+    """Render a LoadTestReport as a plain text table."""
+    cfg = report.config
+    lines = [
+        f"{cfg.workers} counters, target {cfg.rate:g} ops/s, journal_mode={cfg.journal_mode}, "
+        f"synchronous={cfg.synchronous}, busy_timeout={cfg.busy_timeout} ms, "
+        f"group_commit={cfg.group_commit}, {'pooled' if cfg.pooled else 'unpooled'}",
+        f"throughput {report.throughput:.1f} ops/s over {report.elapsed:.1f} s, "
+        f"{report.busy_retries} SQLITE_BUSY retries",
+        f"{'operation':<10}{'done':>8}{'failed':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}",
+    ]
+    for s in report.ops:
+        lines.append(
+            f"{s.op:<10}{s.count:>8}{s.failed:>8}{s.p50:>10.1f}{s.p90:>10.1f}{s.p99:>10.1f}{s.max:>10.1f}"
+        )
+    if report.start_lag > LATE_START:
+        lines.append(
+            f"warning: a counter started {report.start_lag:.2f} s late, "
+            "the offered load was lower than configured"
+        )
+    return '\n'.join(lines)
+
+class _Counter:
+    """One simulated counter; lives in its own worker process.
+
+    Workers move disjoint sets of items (inventory number modulo the
+    number of workers), so a failed move means contention, never
+    another counter having moved the item first.
+    """
+    def __init__(self, filepath, config, index) -> None:
+        self.filepath = filepath
+        self.config = config
+        self.index = index
+        self.pragmas = {'busy_timeout': config.busy_timeout, 'synchronous': config.synchronous}
+        self.opened = 0
+        self.db = self._open() if config.pooled else None
+        db = self.db if config.pooled else self._open()
+        mine = {nr for nr in db.inventory_numbers() if nr % config.workers == index}
+        self.out = sorted(mine & db.out_inventory_numbers())
+        self.available = sorted(mine - set(self.out))
+        self.customers = [row[0] for row in db.customer_summaries()]
+        if not self.customers:
+            raise ValueError("no customers to check items out to")
+        if not mine:
+            raise ValueError(f"no items for counter {index} to move")
+        self.words = [
+            name[i:i + 3] for _sku, name, _notes in db.search_SKUs('')
+            for i in range(0, max(1, len(name) - 2), 3)
+        ] or ['']
+        # history reads follow the history from its current end
+        self.last_ids = {table: db.last_id(table) for table in (CHECKIN, CHECKOUT)}
+        if not config.pooled:
+            conn_name = db.conn_name
+            del db # its prepared queries must go before the connection
+            _drop_connection(conn_name)
+    def run_op(self, op):
+        """Run one operation, retrying while the file is locked.
+
+        :return: the operation actually run (a checkout when there's
+        nothing to check in and vice versa), success and the number
+        of SQLITE_BUSY retries
+        :rtype: tuple
+        """
+        if op == CHECKOUT and not self.available:
+            op = CHECKIN
+        elif op == CHECKIN and not self.out:
+            op = CHECKOUT
+        db = self.db if self.config.pooled else self._open()
+        retries = 0
+        while True:
+            db.last_error = None
+            ok = self._attempt(db, op)
+            if ok or not _busy(db.last_error) or retries >= self.config.max_retries:
+                break
+            retries += 1
+            time.sleep(random.uniform(0.001, 0.005) * retries)
+        if not self.config.pooled:
+            conn_name = db.conn_name
+            del db
+            _drop_connection(conn_name)
+        return op, ok, retries
+    def _attempt(self, db, op):
+        if op == CHECKOUT:
+            nrs = self._pick(self.available)
+            if db.checkout_many(nrs, random.choice(self.customers)):
+                self._move(nrs, self.available, self.out)
+                return True
+            return False
+        if op == CHECKIN:
+            nrs = self._pick(self.out)
+            if db.checkin_many(nrs):
+                self._move(nrs, self.out, self.available)
+                return True
+            return False
+        if op == SEARCH:
+            db.search_SKUs(random.choice(self.words))
+        else:
+            table = random.choice((CHECKIN, CHECKOUT))
+            rows = db.history(table, self.last_ids[table])
+            if rows:
+                self.last_ids[table] = rows[-1][0]
+        return db.last_error is None
+    def _pick(self, nrs):
+        return random.sample(nrs, min(self.config.group_commit, len(nrs)))
+    def _move(self, nrs, source, target):
+        moved = set(nrs)
+        source[:] = [nr for nr in source if nr not in moved]
+        target.extend(nrs)
+    def _open(self):
+        self.opened += 1
+        conn_name = open_db(
+            self.filepath, f"counter-{self.index}:{self.opened}", self.pragmas
+        )
+        if conn_name == '':
+            raise OSError(f"open_db({self.filepath}) failed in counter {self.index}")
+        return InventoryDB(conn_name)
+    def close(self):
+        if self.db is not None:
+            conn_name = self.db.conn_name
+            self.db = None
+            _drop_connection(conn_name)
+
+def _worker(filepath, config, index, ready, start, results):
+    """Process entry point: warm up, report ready, wait for the common start, run paced load."""
+    app = QCoreApplication([]) # loads the SQL driver plugins
+    try:
+        counter = _Counter(filepath, config, index)
+    except Exception as e:
+        ready.put((index, repr(e), None))
+        return
+    ready.put((index, None, None))
+    start_at = start.get()
+    try:
+        stats = _load(counter, config, index, start_at)
+    except Exception as e:
+        results.put((index, repr(e), None))
+        return
+    finally:
+        counter.close()
+    results.put((index, None, stats))
+    del app
+
+def _load(counter, config, index, start_at):
+    """Run a worker's paced share of the load.
+
+    :return: latencies, failures, SQLITE_BUSY retries, start lag and end time
+    :rtype: tuple
+    """
+    latencies = {op: [] for op in config.mix}
+    failed = {op: 0 for op in config.mix}
+    busy_retries = 0
+    ops, weights = zip(*config.mix.items())
+    interval = config.workers / config.rate
+    # stagger the counters so that they don't all fire at once
+    next_at = start_at + interval * index / config.workers
+    end_at = start_at + config.duration
+    start_lag = None
+    while next_at < end_at and time.time() < end_at:
+        delay = next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if start_lag is None:
+            start_lag = max(0.0, time.time() - next_at)
+        op = random.choices(ops, weights)[0]
+        began = time.perf_counter()
+        op, ok, retries = counter.run_op(op)
+        elapsed = time.perf_counter() - began
+        busy_retries += retries
+        if ok:
+            latencies[op].append(elapsed)
+        else:
+            failed[op] += 1
+        next_at += interval # open loop: falling behind doesn't lower the offered load
+    return latencies, failed, busy_retries, start_lag or 0.0, time.time()
+
+def _busy(error):
+    if error is None:
+        return False
+    code = error.nativeErrorCode()
+    # extended result codes (e.g. SQLITE_BUSY_SNAPSHOT) keep the primary code in the low byte
+    return code.isdigit() and int(code) & 0xff in (SQLITE_BUSY, SQLITE_LOCKED)
+
+def _drop_connection(conn_name):
+    QSqlDatabase.database(conn_name).close()
+    QSqlDatabase.removeDatabase(conn_name)
@@ -3,6 +3,14 @@ from .gui.open_db_dlg import OpenDatabaseDialog
 from .gui.main_wnd import MainWnd
 from .database import InventoryDB, open_db, create_db
 from .datamodel import InventoryModel
+from .changes import ChangeBus, DataVersionWatcher
+from .integrity import IntegrityChecker, DANGLING, check_shards
+from .shards import open_shards
+from .pricing import Pricing
+from .loadtest import LoadTestConfig, run_load_test, format_report
+from .maintenance import Maintenance, MaintenanceScheduler
+from datetime import datetime, timedelta
+import json
 import sys
 import os
 from PyQt5.QtWidgets import QApplication, QMessageBox
@@ -24,11 +32,12 @@ def main():
     if args.gui:
     # mode 1/3: working with an existing DB via GUI
         app = QApplication(sys.argv)
-        if not args.db_filepath:
+        db_filepath = args.db_filepath
+        if not db_filepath:
             open_dlg = OpenDatabaseDialog()
             if open_dlg.exec(): #a modal dialog runs its own event loop
-                conn_name = open_db(open_dlg.get_filename())
-        else: conn_name = open_db(args.db_filepath)
+                db_filepath = open_dlg.get_filename()
+        conn_name = open_db(db_filepath) if db_filepath else ''
         if conn_name == '':
             pass 
             QMessageBox.critical(
@@ -37,9 +46,83 @@ def main():
                 text="open_db(db) : could not establish connection to database."
             )
         else:
-            main_wnd = MainWnd(InventoryModel(InventoryDB(conn_name)))
+            bus = ChangeBus()
+            db = InventoryDB(conn_name, bus)
+            db.ensure_schema()
+            main_wnd = MainWnd(InventoryModel(db))
+            main_wnd.watcher = DataVersionWatcher(db, bus, parent=main_wnd)
+            main_wnd.scheduler = MaintenanceScheduler(
+                Maintenance(db, db_filepath), bus, archive_age_days=args.archive_days,
+                parent=main_wnd
+            )
             main_wnd.show()
             sys.exit(app.exec())
+    elif args.check and args.depots_spec:
+    # administration: checking the depots of a multi-depot setup
+        sys.exit(depot_check_session(args.depots_spec, args.repair))
+    elif args.check:
+    # administration: checking (and optionally repairing) a db
+        if not args.db_filepath or not os.path.exists(args.db_filepath):
+            print("Error: --check needs an existing database, pass it with --file.")
+            sys.exit(1)
+        conn_name = open_db(args.db_filepath)
+        if conn_name == '':
+            print("Error: sqlite driver couldn't open the file provided by you.")
+            sys.exit(1)
+        sys.exit(check_session(InventoryDB(conn_name), args.repair))
+    elif args.snapshot_path:
+    # reporting: exporting a read-only snapshot
+        if not args.db_filepath or not os.path.exists(args.db_filepath):
+            print("Error: --snapshot needs an existing database, pass it with --file.")
+            sys.exit(1)
+        conn_name = open_db(args.db_filepath)
+        if conn_name == '':
+            print("Error: sqlite driver couldn't open the file provided by you.")
+            sys.exit(1)
+        from .snapshot import export_snapshot # numpy is only needed here
+        n_items, n_moves = export_snapshot(InventoryDB(conn_name), args.snapshot_path)
+        print(f"Snapshot of {n_items} items and {n_moves} history records written to {args.snapshot_path}")
+    elif args.bill_month:
+    # administration: invoicing a month's returns
+        if not args.db_filepath or not os.path.exists(args.db_filepath):
+            print("Error: --bill needs an existing database, pass it with --file.")
+            sys.exit(1)
+        conn_name = open_db(args.db_filepath)
+        if conn_name == '':
+            print("Error: sqlite driver couldn't open the file provided by you.")
+            sys.exit(1)
+        sys.exit(billing_session(InventoryDB(conn_name), args.bill_month))
+    elif args.load_test:
+    # administration: measuring how many counters a file supports
+        if not args.db_filepath or not os.path.exists(args.db_filepath):
+            print("Error: --load-test needs an existing database, pass it with --file.")
+            sys.exit(1)
+        config = LoadTestConfig(
+            workers=args.workers,
+            rate=args.rate,
+            duration=args.duration,
+            journal_mode=args.journal_mode,
+            synchronous=args.synchronous,
+            busy_timeout=args.busy_timeout,
+            group_commit=args.group_commit,
+            pooled=not args.no_pooling
+        )
+        report = run_load_test(args.db_filepath, config)
+        if report is None:
+            print("Error: sqlite driver couldn't open or copy the file provided by you, "
+                "or a simulated counter failed (a file without customers or items can't be tested).")
+            sys.exit(1)
+        print(format_report(report))
+    elif args.maintain:
+    # administration: running all maintenance now
+        if not args.db_filepath or not os.path.exists(args.db_filepath):
+            print("Error: --maintain needs an existing database, pass it with --file.")
+            sys.exit(1)
+        conn_name = open_db(args.db_filepath)
+        if conn_name == '':
+            print("Error: sqlite driver couldn't open the file provided by you.")
+            sys.exit(1)
+        sys.exit(maintenance_session(InventoryDB(conn_name), args.db_filepath, args.archive_days))
     elif args.new_db:
     # mode 2/3: administration, creating a db
         path = args.db_filepath if args.db_filepath else os.getcwd()
@@ -82,6 +165,101 @@ def setup_argparser(parser):
         dest="gui",
         help="Start with a graphical interface."
     )
+    parser.add_argument(
+        "--check",
+        required=False,
+        action="store_true",
+        dest="check",
+        help="Check database integrity and exit."
+    )
+    parser.add_argument(
+        "--repair",
+        required=False,
+        action="store_true",
+        dest="repair",
+        help="With --check: recreate missing referenced rows as placeholders."
+    )
+    parser.add_argument(
+        "--depots",
+        required=False,
+        dest="depots_spec",
+        metavar="SPEC.json",
+        help="With --check: check every depot, and inventory numbers across them. "
+            'SPEC.json maps depot names to [file, first inv_nr, last inv_nr], '
+            'e.g. {"north": ["north.db", 1, 49999]}.'
+    )
+    parser.add_argument(
+        "--snapshot",
+        required=False,
+        dest="snapshot_path",
+        help="Export a read-only snapshot for reports and kiosks to this file."
+    )
+    parser.add_argument(
+        "--bill",
+        required=False,
+        dest="bill_month",
+        metavar="YYYY-MM",
+        help="Invoice all rentals returned in this month and exit."
+    )
+    parser.add_argument(
+        "--maintain",
+        required=False,
+        action="store_true",
+        dest="maintain",
+        help="Update statistics, archive old history (with --archive-days) and "
+            "vacuum, all at once; best while no counter is working."
+    )
+    parser.add_argument(
+        "--archive-days",
+        required=False,
+        type=int,
+        dest="archive_days",
+        help="Move checkin/checkout records older than this many days to the "
+            "archive file next to the database, when idle or with --maintain."
+    )
+    load = parser.add_argument_group("load test")
+    load.add_argument(
+        "--load-test",
+        required=False,
+        action="store_true",
+        dest="load_test",
+        help="Simulate concurrent counters on a copy of the database and report "
+            "throughput, latencies and SQLITE_BUSY retries."
+    )
+    load.add_argument("--workers", type=int, default=4, help="Counters, one process each.")
+    load.add_argument("--rate", type=float, default=50.0, help="Target operations per second in total.")
+    load.add_argument("--duration", type=float, default=30.0, help="Seconds to run.")
+    load.add_argument(
+        "--journal-mode",
+        default="WAL",
+        choices=["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"],
+        dest="journal_mode"
+    )
+    load.add_argument(
+        "--synchronous",
+        default="NORMAL",
+        choices=["OFF", "NORMAL", "FULL", "EXTRA"]
+    )
+    load.add_argument(
+        "--busy-timeout",
+        type=int,
+        default=5000,
+        dest="busy_timeout",
+        help="Milliseconds to wait for a lock before SQLITE_BUSY."
+    )
+    load.add_argument(
+        "--group-commit",
+        type=int,
+        default=1,
+        dest="group_commit",
+        help="Items checked in or out per transaction."
+    )
+    load.add_argument(
+        "--no-pooling",
+        action="store_true",
+        dest="no_pooling",
+        help="Open a new connection for every operation."
+    )
     parser.add_argument(
         "--new-db",
         "-n",
@@ -89,6 +267,7 @@ def setup_argparser(parser):
         help="Create a new database."
     )
 def interactive_session(db):
+    db.ensure_schema()
     while True:
         # at each iteration defaults are loaded
         # so that the previous one won't corrupt the queries
@@ -136,6 +315,111 @@ def interactive_session(db):
             db.checkin(inv_no)
         elif action in ['checkout', 'co']:
             pass
+def check_session(db, repair=False, samples=20) -> int:
+    """Print integrity problems, repair if asked.
+
+    :param samples: how many problems of each kind to print
+    :type samples: int
+    :return: exit status, 0 if no problems are left
+    :rtype: int
+    """
+    printed = {}
+    def report(problem):
+        printed[problem.kind] = printed.get(problem.kind, 0) + 1
+        if printed[problem.kind] <= samples:
+            print(f"{problem.kind}: {problem.table} {problem.key}, {problem.detail}")
+    checker = IntegrityChecker(db)
+    counts = checker.check(report)
+    for kind, count in counts.items():
+        print(f"{count} x {kind}")
+    if repair and counts[DANGLING]:
+        for table, count in checker.repair().items():
+            print(f"{count} placeholder rows recreated in {table}")
+        counts = checker.check()
+    return 1 if any(counts.values()) else 0
+def depot_check_session(spec_path, repair=False) -> int:
+    """Check each depot like check_session, then the inventory numbers across them.
+
+    :param spec_path: JSON file mapping depot names to [file, first inv_nr, last inv_nr]
+    :type spec_path: path
+    :return: exit status, 0 if no problems are left
+    :rtype: int
+    """
+    try:
+        with open(spec_path) as spec_file:
+            spec = json.load(spec_file)
+        sharded = open_shards(spec)
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Error: can't open the depots of {spec_path}: {e}")
+        return 1
+    try:
+        status = 0
+        for location, db in sharded.dbs.items():
+            print(f"depot {location}:")
+            status = max(status, check_session(db, repair))
+        print("across depots:")
+        def report(problem):
+            print(f"{problem.kind}: {problem.table} {problem.key}, {problem.detail}")
+        try:
+            counts = check_shards(sharded, report)
+        except OSError as e:
+            print(f"Error: {e}")
+            return 1
+        for kind, count in counts.items():
+            print(f"{count} x {kind}")
+        return 1 if status or any(counts.values()) else 0
+    finally:
+        sharded.close()
+def billing_session(db, month) -> int:
+    """Invoice a month's returns and print a summary.
+
+    :param month: 'YYYY-MM'
+    :type month: str
+    :return: exit status
+    :rtype: int
+    """
+    try:
+        start = datetime.strptime(month, '%Y-%m').date()
+    except ValueError:
+        print(f"Error: {month} isn't a month, use YYYY-MM.")
+        return 1
+    end = (start + timedelta(days=31)).replace(day=1)
+    db.ensure_schema()
+    result = Pricing(db).bill(start.isoformat(), end.isoformat())
+    if result is None:
+        print("Error: billing failed, SQLite transaction rolled back, nothing invoiced.")
+        return 1
+    print(f"{result.invoices} invoices, {result.lines} rentals, {result.total} total")
+    if result.unpriced:
+        print(f"{result.unpriced} rentals left unbilled, their SKUs have no rate")
+    return 0
+def maintenance_session(db, filepath, archive_days=None) -> int:
+    """Run every maintenance step to completion, printing progress.
+
+    :return: exit status
+    :rtype: int
+    """
+    db.ensure_schema()
+    maintenance = Maintenance(db, filepath)
+    if not maintenance.optimize():
+        print("Error: updating the query planner statistics failed.")
+        return 1
+    print("Statistics updated")
+    if archive_days is not None:
+        archived = 0
+        while (moved := maintenance.archive_step(archive_days)) > 0:
+            archived += moved
+        if moved < 0:
+            print("Error: archiving failed, the last chunk was rolled back.")
+            return 1
+        print(f"{archived} history records archived")
+    if not maintenance.enable_incremental_vacuum():
+        print("Error: switching to incremental vacuum failed.")
+        return 1
+    while maintenance.vacuum_step():
+        pass
+    print("Free pages returned to the file system")
+    return 0
 def create_db_session(path) -> str:
     print(f"Attempting to create a new database at {path}")
     if input("Create new database? (y/n)") == 'y':
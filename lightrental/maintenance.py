@@ -0,0 +1,307 @@
+"""
+LightRental database maintenance.
+
+Keeps a counter's database fast as the history grows:
+
+- statistics for the query planner (ANALYZE, then PRAGMA optimize),
+- incremental vacuum, returning free pages to the file system a
+  chunk at a time (files created with auto_vacuum = INCREMENTAL;
+  enable_incremental_vacuum() converts older ones),
+- archiving: checkin/checkout records older than a given age move to
+  an archive file next to the database.
+
+Archiving is an audited move. A chunk of records is copied into the
+archive and committed there first; then the copy is counted, an
+archive_log entry recording the chunk's id range is added and only
+then are the records deleted from the main file. The history tables'
+deletion guards let through exactly the rows some archive_log entry
+covers. Checkouts of items still out stay in the
+main file. Connections attach the archive read-only and read history
+through views spanning both files, so nothing else notices the move.
+The archive is created along with the database, so that connections
+opened before the first move have it attached too.
+
+MaintenanceScheduler runs these steps while the counter is idle, one
+short step per timer tick, so neither this counter's UI nor other
+counters wait on a long write lock.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtSql import QSqlQuery
+from .database import ARCHIVE_SCHEMA, archive_path, archive_schema_sql, attach_archive
+
+ANALYZED_SQL = "SELECT 1 FROM main.sqlite_master WHERE name = 'sqlite_stat1'"
+INCREMENTAL = 2 # PRAGMA auto_vacuum value
+ARCHIVE_ALL = 2**62 # no upper bound on archivable ids
+
+class Maintenance:
+    """Maintenance steps on one LightRental database.
+
+    Every step is short and bounded, and reports whether more of its
+    work is left.
+    """
+    def __init__(self, db, filepath) -> None:
+        """
+        :param db: database to maintain
+        :type db: InventoryDB
+        :param filepath: its file, which the archive file is named after
+        :type filepath: path
+        """
+        self.db = db
+        self.filepath = filepath
+    def optimize(self) -> bool:
+        """Refresh the query planner's statistics.
+
+        The first run analyzes every table; later ones let SQLite
+        re-analyze only what has changed enough to matter. Both stay
+        within the main file: the archive is attached read-only.
+        """
+        query = QSqlQuery(self.db.connection_handle())
+        query.exec(ANALYZED_SQL)
+        analyzed = query.next()
+        ok = query.exec("PRAGMA main.optimize" if analyzed else "ANALYZE main")
+        query.finish()
+        return ok
+    def vacuum_step(self, pages=1000) -> bool:
+        """Return up to a number of free pages to the file system.
+
+        The pragma frees one page each time the statement is stepped,
+        and QSqlQuery steps it only once, as it yields no rows; hence
+        it runs once per page, until pages are freed or the free list
+        stops shrinking.
+
+        :return: whether free pages are left
+        :rtype: bool
+        """
+        if self._pragma("auto_vacuum") != INCREMENTAL:
+            return False
+        free = self._pragma("freelist_count")
+        query = QSqlQuery(self.db.connection_handle())
+        query.prepare("PRAGMA incremental_vacuum(1)")
+        for _page in range(int(pages)):
+            if free == 0 or not query.exec():
+                break
+            left = self._pragma("freelist_count")
+            if left >= free:
+                break
+            free = left
+        query.finish()
+        return free > 0
+    def enable_incremental_vacuum(self) -> bool:
+        """Switch an older file to auto_vacuum = INCREMENTAL.
+
+        Rewrites the whole file with a full VACUUM, which holds an
+        exclusive lock meanwhile: run it when no counter is working.
+        """
+        if self._pragma("auto_vacuum") == INCREMENTAL:
+            return True
+        query = QSqlQuery(self.db.connection_handle())
+        ok = query.exec("PRAGMA auto_vacuum = INCREMENTAL") and query.exec("VACUUM")
+        query.finish()
+        return ok
+    def archive_step(self, max_age_days, chunk_size=50000) -> int:
+        """Move a chunk of history older than max_age_days to the archive.
+
+        :param max_age_days: records at least this old are archived
+        :type max_age_days: int
+        :param chunk_size: most records moved per table
+        :type chunk_size: int
+        :return: records moved; 0 once there's nothing left to archive,
+        -1 if a move failed and was rolled back
+        :rtype: int
+        """
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(sep=' ', timespec='seconds')
+        chunks = []
+        for table in self.db.md.tables():
+            if table.archivable:
+                first, last = self._next_chunk(table, cutoff, chunk_size)
+                if first <= last:
+                    chunks.append((table, first, last))
+        if not chunks:
+            return 0
+        handle = self.db.connection_handle()
+        query = QSqlQuery(handle)
+        # invoice lines of files created before archiving still reference checkouts
+        query.exec("PRAGMA foreign_keys = OFF")
+        moved = 0
+        try:
+            attach_archive(handle, self.filepath, writable=True, md=self.db.md)
+            for table, first, last in chunks:
+                rows = self._move(handle, table, first, last)
+                if rows < 0:
+                    moved = -1
+                    break
+                moved += rows
+        finally:
+            attach_archive(handle, self.filepath, md=self.db.md)
+            query.exec("PRAGMA foreign_keys = ON")
+            query.finish()
+        return moved
+    def _move(self, handle, table, first, last):
+        """Move records first..last of a history table to the attached archive.
+
+        Two transactions, as a transaction spanning two files isn't
+        atomic in WAL mode: the first copies the records and logs the
+        copy in the archive, the second checks the copy, logs the move
+        and deletes the records from the main file. If only the first
+        commits, the records are copied again next time.
+
+        :return: records moved, -1 on failure
+        :rtype: int
+        """
+        md = self.db.md
+        cols = ', '.join(c.name for c in table.columns())
+        where = f"{table.key().name} BETWEEN :first AND :last"
+        query = QSqlQuery(handle)
+        for statement in archive_schema_sql(md): # archives of older files may lack them
+            if not query.exec(statement):
+                return -1
+        log = (
+            "INSERT INTO {}.archive_log (time, table_name, first_id, last_id, rows, archive) "
+            f"SELECT :now, :table, :first, :last, COUNT(*), :archive FROM main.{table.table} WHERE {where}"
+        )
+        values = {
+            ":first": first, ":last": last, ":table": table.table,
+            ":now": datetime.now().isoformat(sep=' ', timespec='seconds'),
+            ":archive": os.path.basename(archive_path(self.filepath)),
+        }
+        transactions = [
+            [
+                # OR IGNORE: records copied by an interrupted earlier move
+                f"INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.{table.table} ({cols}) "
+                f"SELECT {cols} FROM main.{table.table} WHERE {where}",
+                log.format(ARCHIVE_SCHEMA),
+            ],
+            [
+                log.format('main'),
+                f"DELETE FROM main.{table.table} WHERE {where}",
+            ],
+        ]
+        rows = 0
+        for n, statements in enumerate(transactions):
+            if not handle.transaction():
+                return -1
+            ok = True
+            if n == 1:
+                rows = self._count(query, f"SELECT COUNT(*) FROM main.{table.table} WHERE {where}", values)
+                copied = self._count(query, f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{table.table} WHERE {where}", values)
+                ok = rows == copied # never delete what the archive lacks
+            for sql in statements:
+                ok = ok and self._exec(query, sql, values)
+            query.finish()
+            if not ok:
+                handle.rollback()
+                return -1
+            if not handle.commit():
+                handle.rollback()
+                return -1
+        return rows
+    def _next_chunk(self, table, cutoff, chunk_size):
+        """The next chunk of a history table's records older than cutoff.
+
+        Records are archived in id order, and ids grow with time, so
+        the archived part of a table is always the ids up to the
+        greatest last_id in archive_log.
+
+        :return: first and last id of the chunk; first > last if there's none
+        :rtype: tuple
+        """
+        key = table.key().name
+        query = QSqlQuery(self.db.connection_handle())
+        query.prepare(
+            "SELECT COALESCE(MAX(last_id), 0) FROM archive_log WHERE table_name = :table"
+        )
+        query.bindValue(":table", table.table)
+        query.exec()
+        first = (query.value(0) if query.next() else 0) + 1
+        sql = (
+            # the next chunk_size records, up to the first recent one
+            f"SELECT COALESCE(MIN(CASE WHEN time >= :cutoff THEN {key} END) - 1, MAX({key}), 0) "
+            f"FROM (SELECT {key}, time FROM main.{table.table} WHERE {key} >= :first "
+            f"ORDER BY {key} LIMIT :chunk)"
+        )
+        if table.table == self.db.md.checkouts.table:
+            # checkouts of items still out stay
+            sql = f"SELECT MIN(({sql}), COALESCE((SELECT MIN(checkout_id) - 1 FROM items_out), {ARCHIVE_ALL}))"
+        query.prepare(sql)
+        query.bindValue(":cutoff", cutoff)
+        query.bindValue(":first", first)
+        query.bindValue(":chunk", chunk_size)
+        query.exec()
+        last = query.value(0) if query.next() else 0
+        query.finish()
+        return first, last
+    def _pragma(self, name):
+        query = QSqlQuery(self.db.connection_handle())
+        query.exec(f"PRAGMA {name}")
+        value = query.value(0) if query.next() else None
+        query.finish()
+        return value
+    def _count(self, query, sql, values):
+        if not self._exec(query, sql, values) or not query.next():
+            return -1
+        return query.value(0)
+    def _exec(self, query, sql, values):
+        query.prepare(sql)
+        for placeholder, value in values.items():
+            query.bindValue(placeholder, value)
+        return query.exec()
+
+class MaintenanceScheduler(QObject):
+    """Runs maintenance steps while the counter is idle.
+
+    The counter is idle once nothing has been written, by this process
+    or any other, for idle_s seconds. Then every tick runs a single
+    step: statistics at most every optimize_every_s, archiving (if
+    archive_age_days is set) and incremental vacuum, each repeated on
+    later ticks until it has nothing left to do.
+    """
+    def __init__(self, maintenance, bus=None, archive_age_days=None, idle_s=120.0,
+                 tick_ms=5000, optimize_every_s=24 * 3600, parent=None) -> None:
+        """Start the timer.
+
+        :param maintenance: steps to run
+        :type maintenance: Maintenance
+        :param bus: writes it publishes end idle periods
+        :type bus: ChangeBus, optional
+        :param archive_age_days: archive history older than this; None not to archive
+        :type archive_age_days: int, optional
+        """
+        super().__init__(parent)
+        self.maintenance = maintenance
+        self.archive_age_days = archive_age_days
+        self.idle_s = idle_s
+        self.optimize_every_s = optimize_every_s
+        self.last_activity = time.monotonic()
+        self.last_optimized = None
+        self.archive_pending = archive_age_days is not None
+        self.vacuum_pending = True
+        if bus is not None:
+            bus.changed.connect(self.on_activity)
+            bus.external_change.connect(self.on_activity)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(tick_ms)
+    def on_activity(self, *_args):
+        self.last_activity = time.monotonic()
+        # new records may be archivable, new free pages appear after archiving
+        self.archive_pending = self.archive_age_days is not None
+        self.vacuum_pending = True
+    def tick(self):
+        now = time.monotonic()
+        if now - self.last_activity < self.idle_s:
+            return
+        if self.last_optimized is None or now - self.last_optimized >= self.optimize_every_s:
+            self.maintenance.optimize()
+            self.last_optimized = now
+        elif self.archive_pending:
+            moved = self.maintenance.archive_step(self.archive_age_days)
+            self.archive_pending = moved > 0
+            self.vacuum_pending = self.vacuum_pending or moved > 0
+        elif self.vacuum_pending:
+            self.vacuum_pending = self.maintenance.vacuum_step()
+    def stop(self):
+        self.timer.stop()
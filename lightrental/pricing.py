@@ -0,0 +1,191 @@
+"""
+LightRental pricing and invoicing.
+
+Prices come from per-SKU day rates with two discounts - a fraction
+off weekend days and a fraction off days that make up full weeks -
+and a per-customer factor. A rental is a checkout paired with the
+item's next checkin; it is billed in the period it was returned in.
+
+Billing a period is a single set-based pass in SQLite: one query pairs
+the period's checkins with their checkouts - one window over the
+history, archived moves included, taking each move's predecessor -
+counts days and weekend days with integer arithmetic on day
+numbers and prices every rental; two more group them into invoices.
+No rental is ever priced one by one in Python, so a month of hundreds
+of thousands of rentals is billed in seconds.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from PyQt5.QtSql import QSqlQuery
+
+BillingResult = namedtuple(
+    "BillingResult",
+    ['invoices', 'lines', 'total', 'unpriced'] # unpriced: rentals of SKUs without a rate
+)
+
+# Day number of a timestamp: Julian Day Number, which is 0 mod 7 on Mondays,
+# so Saturdays are 5 and Sundays 6 mod 7.
+DAY_SQL = "CAST(julianday(date({})) + 0.5 AS INTEGER)"
+
+BILLING_LINES_SQL = (
+    "CREATE TEMP TABLE billing_lines AS "
+    "WITH moves AS ("
+    f" SELECT inv_nr, time, id, customer_id, 1 AS is_out, {DAY_SQL.format('time')} AS day"
+    " FROM checkout_history WHERE time < :end"
+    " UNION ALL"
+    f" SELECT inv_nr, time, id, customer_id, 0 AS is_out, {DAY_SQL.format('time')} AS day"
+    " FROM checkin_history WHERE time < :end"
+    "), paired AS ("
+    # the move before each one; same-second moves are ordered checkout first.
+    # Being a window, this is computed once, unlike expressions of the
+    # CTEs below, which SQLite copies into every use.
+    " SELECT inv_nr, time, day, is_out, LAG(is_out) OVER w AS prev_is_out,"
+    " LAG(id) OVER w AS prev_id, LAG(time) OVER w AS prev_time, LAG(day) OVER w AS prev_day,"
+    " LAG(customer_id) OVER w AS prev_customer_id"
+    " FROM moves WINDOW w AS (PARTITION BY inv_nr ORDER BY time, is_out DESC, id)"
+    "), returns AS ("
+    # a checkin right after a checkout ends that rental; repeated
+    # checkins (see the integrity module) end nothing
+    " SELECT prev_id AS checkout_id, inv_nr, prev_customer_id AS customer_id,"
+    " prev_time AS start_time, time AS end_time, prev_day AS first_day,"
+    " MAX(1, day - prev_day) AS days FROM paired"
+    " WHERE is_out = 0 AND prev_is_out = 1 AND time >= :start"
+    "), rentals AS ("
+    " SELECT r.checkout_id, r.inv_nr, i.sku, r.customer_id, r.start_time, r.end_time,"
+    " r.first_day, r.days"
+    " FROM returns r"
+    " JOIN inventory i ON i.inv_nr = r.inv_nr"
+    " WHERE NOT EXISTS (SELECT 1 FROM invoice_lines l WHERE l.checkout_id = r.checkout_id)"
+    "), split AS ("
+    # full weeks, then the remaining days [rest_from, rest_to)
+    " SELECT *, days / 7 AS weeks, first_day + days / 7 * 7 AS rest_from,"
+    " first_day + days AS rest_to FROM rentals"
+    ") "
+    "SELECT s.checkout_id, s.inv_nr, s.customer_id, s.start_time, s.end_time, s.days,"
+    " ROUND(r.day_rate * COALESCE(c.factor, 1) * ("
+    "  s.weeks * 7 * (1 - r.weekly_discount)"
+    "  + (s.rest_to - s.rest_from)"
+    # Saturdays plus Sundays among the remaining days
+    "  - ((s.rest_to + 1) / 7 - (s.rest_from + 1) / 7"
+    "     + s.rest_to / 7 - s.rest_from / 7) * r.weekend_discount"
+    " ), 2) AS amount "
+    "FROM split s "
+    "LEFT JOIN sku_rates r ON r.sku = s.sku "
+    "LEFT JOIN customer_rates c ON c.customer_id = s.customer_id"
+)
+
+class Pricing:
+    """Rate maintenance and period billing for one LightRental database."""
+    def __init__(self, db) -> None:
+        """
+        :param db: database to price and bill
+        :type db: InventoryDB
+        """
+        self.db = db
+    def set_SKU_rate(self, sku, day_rate, weekend_discount=0.0, weekly_discount=0.0) -> bool:
+        """Set an SKU's price.
+
+        :param day_rate: price of one rental day
+        :type day_rate: float
+        :param weekend_discount: fraction off Saturdays and Sundays
+        :type weekend_discount: float
+        :param weekly_discount: fraction off days that make up full weeks
+        :type weekly_discount: float
+        """
+        return self._exec(
+            "INSERT OR REPLACE INTO sku_rates (sku, day_rate, weekend_discount, weekly_discount) "
+            "VALUES (:sku, :day_rate, :weekend_discount, :weekly_discount)",
+            {":sku": sku, ":day_rate": day_rate,
+             ":weekend_discount": weekend_discount, ":weekly_discount": weekly_discount}
+        )
+    def set_customer_factor(self, customer_id, factor) -> bool:
+        """Set a customer's price multiplier, e.g. 0.9 for 10% off everything."""
+        return self._exec(
+            "INSERT OR REPLACE INTO customer_rates (customer_id, factor) "
+            "VALUES (:customer_id, :factor)",
+            {":customer_id": customer_id, ":factor": factor}
+        )
+    def bill(self, start, end) -> BillingResult:
+        """Invoice every rental returned within [start, end), one invoice per customer.
+
+        Rentals already on an invoice are skipped, so billing a period
+        again only picks up late additions. Everything is written in
+        one transaction.
+
+        :param start: period start, 'YYYY-MM-DD[ HH:MM:SS]'
+        :type start: str
+        :param end: period end, exclusive
+        :type end: str
+        :return: what has been billed; None if the transaction failed
+        :rtype: BillingResult
+        """
+        handle = self.db.connection_handle()
+        if not handle.transaction():
+            return None
+        query = QSqlQuery(handle)
+        statements = [
+            ("DROP TABLE IF EXISTS temp.billing_lines", {}),
+            (BILLING_LINES_SQL, {":start": start, ":end": end}),
+            ("INSERT INTO invoices (customer_id, period_start, period_end, created, total) "
+             "SELECT customer_id, :start, :end, :now, ROUND(SUM(amount), 2) "
+             "FROM temp.billing_lines WHERE amount IS NOT NULL "
+             "GROUP BY customer_id ORDER BY customer_id",
+             {":start": start, ":end": end,
+              ":now": datetime.now().isoformat(sep=' ', timespec='seconds')}),
+        ]
+        query.exec("SELECT COALESCE(MAX(id), 0) FROM invoices")
+        last_invoice = query.value(0) if query.next() else 0
+        statements.append((
+            "INSERT INTO invoice_lines "
+            "(invoice_id, checkout_id, inv_nr, start_time, end_time, days, amount) "
+            "SELECT v.id, l.checkout_id, l.inv_nr, l.start_time, l.end_time, l.days, l.amount "
+            "FROM temp.billing_lines l "
+            "JOIN invoices v ON v.customer_id = l.customer_id AND v.id > :last_invoice "
+            "WHERE l.amount IS NOT NULL",
+            {":last_invoice": last_invoice}
+        ))
+        for sql, values in statements:
+            query.prepare(sql)
+            for placeholder, value in values.items():
+                query.bindValue(placeholder, value)
+            if not query.exec():
+                query.finish()
+                handle.rollback()
+                return None
+        query.exec(
+            "SELECT COUNT(DISTINCT customer_id) FILTER (WHERE amount IS NOT NULL), "
+            "COUNT(amount), COALESCE(ROUND(SUM(amount), 2), 0), "
+            "COUNT(*) - COUNT(amount) FROM temp.billing_lines"
+        )
+        query.next()
+        result = BillingResult(*(query.value(i) for i in range(4)))
+        query.exec("DROP TABLE temp.billing_lines")
+        query.finish()
+        if not handle.commit():
+            return None
+        return result
+    def invoices(self, customer_id):
+        """A customer's invoices, newest first.
+
+        :return: (id, period_start, period_end, created, total) tuples
+        :rtype: list
+        """
+        query = QSqlQuery(self.db.connection_handle())
+        query.setForwardOnly(True)
+        query.prepare(
+            "SELECT id, period_start, period_end, created, total FROM invoices "
+            "WHERE customer_id = :customer_id ORDER BY period_start DESC, id DESC"
+        )
+        query.bindValue(":customer_id", customer_id)
+        query.exec()
+        rows = []
+        while query.next():
+            rows.append(tuple(query.value(i) for i in range(5)))
+        return rows
+    def _exec(self, sql, values):
+        query = QSqlQuery(self.db.connection_handle())
+        query.prepare(sql)
+        for placeholder, value in values.items():
+            query.bindValue(placeholder, value)
+        return query.exec()
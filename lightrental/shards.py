@@ -0,0 +1,307 @@
+"""
+LightRental multi-depot module.
+
+Every depot keeps its inventory in its own SQLite file - a shard.
+ShardedInventoryDB mimics the InventoryDB interface: writes are routed
+to the shard owning an inventory number (by range) or a location,
+while cross-depot reads such as SKU search and availability fan out
+to all shards in parallel and get merged.
+
+Customers may rent items from any depot, so they are replicated: every
+shard holds every customer, under the same id.
+
+QtSql connections may only be used from the thread that opened them,
+so each shard gets a single worker thread that opens and owns its
+own connection. Writes use the caller's connection instead.
+
+This is a library layer for scripts and administration, such as the
+cross-depot integrity check; the GUI doesn't run on it. The Qt models
+and the checkin/checkout forms need a single QSqlDatabase, a ChangeBus
+fed from one file's change_log and record ids unique within one
+history - none of which a set of depots has - so ShardedInventoryDB
+offers no connection_handle, bus, last_id, history_page or changes.
+"""
+
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from PyQt5.QtSql import QSqlDatabase
+from .database import InventoryDB, open_db, db_metadata
+
+@dataclass
+class Shard:
+    location: str # depot name, unique among shards
+    filepath: str # depot's SQLite file
+    inv_nrs: range # inventory numbers stored in this depot
+
+class ShardRoutingError(LookupError):
+    """Raised when no shard owns an inventory number or location."""
+
+# numbers the instances, keeping their connection names apart
+_instances = itertools.count(1)
+
+class ShardedInventoryDB:
+    """A set of depot databases behind an InventoryDB-like interface.
+
+    Mutating methods take the same arguments as in InventoryDB;
+    add_category takes an extra location argument, as categories
+    aren't tied to an inventory number. Checkin/checkout batches must
+    stay within one depot, so that they remain all or nothing.
+    History is read through history, which tags every record with
+    its depot, instead of InventoryDB's paged, id-based readers.
+    """
+    def __init__(self, shards) -> None:
+        """Open a connection to each depot and start its worker thread.
+
+        :param shards: depots to serve; inventory number ranges must not overlap
+        :type shards: list of Shard
+        :raises ValueError: on overlapping ranges or duplicate locations
+        :raises OSError: if a depot file can't be opened
+        """
+        self.shards = sorted(shards, key=lambda s: s.inv_nrs.start)
+        for prev, cur in zip(self.shards, self.shards[1:]):
+            if cur.inv_nrs.start < prev.inv_nrs.stop:
+                raise ValueError(
+                    f"inventory ranges of {prev.location} and {cur.location} overlap")
+        self.by_location = {s.location: s for s in self.shards}
+        if len(self.by_location) != len(self.shards):
+            raise ValueError("depot locations must be unique")
+        self.md = db_metadata
+        self.prefix = f"shards{next(_instances)}"
+        self.dbs = {}
+        self.workers = {}
+        # location -> InventoryDB owned by that shard's worker thread;
+        # each entry is only ever touched from its own worker
+        self.worker_dbs = {}
+        for shard in self.shards:
+            conn_name = open_db(shard.filepath, self._conn_name(shard.location, 'main'))
+            if conn_name == '':
+                self.close()
+                raise OSError(f"open_db({shard.filepath}) failed")
+            self.dbs[shard.location] = InventoryDB(conn_name)
+            self.workers[shard.location] = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f"{self.prefix}-{shard.location}"
+            )
+    def close(self):
+        """Stop the worker threads and drop all connections."""
+        for location, worker in self.workers.items():
+            worker.submit(self._close_worker_db, location).result()
+            worker.shutdown()
+        self.workers = {}
+        conn_names = [db.conn_name for db in self.dbs.values()]
+        self.dbs = {} # InventoryDB's prepared queries must go before their connection
+        for conn_name in conn_names:
+            QSqlDatabase.database(conn_name).close()
+            QSqlDatabase.removeDatabase(conn_name)
+    def ensure_schema(self) -> bool:
+        """Bring every depot file up to the current schema.
+
+        :return: whether all of them are
+        :rtype: bool
+        """
+        return all([db.ensure_schema() for db in self.dbs.values()])
+    def shard_for_nr(self, nr) -> Shard:
+        for shard in self.shards:
+            if nr in shard.inv_nrs:
+                return shard
+        raise ShardRoutingError(f"no depot stores inventory number {nr}")
+    def shard_for_location(self, location) -> Shard:
+        try:
+            return self.by_location[location]
+        except KeyError:
+            raise ShardRoutingError(f"unknown depot {location}") from None
+    def db_for_nr(self, nr) -> InventoryDB:
+        return self.dbs[self.shard_for_nr(int(nr)).location]
+    def db_for_location(self, location) -> InventoryDB:
+        return self.dbs[self.shard_for_location(location).location]
+    def db_for_batch(self, nrs) -> InventoryDB:
+        """The depot owning all of a batch of inventory numbers.
+
+        :raises ShardRoutingError: if the batch spans several depots
+        """
+        locations = {self.shard_for_nr(int(nr)).location for nr in nrs}
+        if len(locations) > 1:
+            raise ShardRoutingError(
+                f"batch spans depots {', '.join(sorted(locations))}; move items depot by depot")
+        return self.dbs[locations.pop()] if locations else next(iter(self.dbs.values()))
+    def add_item(self, nr, SKU, category, notes="", imgpath=""):
+        return self.db_for_nr(nr).add_item(nr, SKU, category, notes, imgpath)
+    def add_SKU(self, SKU, sku_name, itm_nr, itm_cat, sku_notes='', itm_notes='', itm_imgpaths=''):
+        return self.db_for_nr(itm_nr).add_SKU(
+            SKU, sku_name, itm_nr, itm_cat, sku_notes, itm_notes, itm_imgpaths
+        )
+    def add_category(self, name, location, notes="") -> bool:
+        return self.db_for_location(location).add_category(name, notes)
+    def add_customer(self, id, name, contacts, notes='') -> bool:
+        """Add a customer to every depot, under the same id.
+
+        A depot that already has the id is skipped, so if some depot
+        failed, calling this again with the id completes the replication.
+
+        :param id: customer id; None for the next one free in all depots
+        :type id: int
+        :return: whether every depot has the customer
+        :rtype: bool
+        """
+        table = self.md.customers.table
+        if id is None:
+            id = 1 + max(last for _location, last in self._fan_out('last_id', table))
+        ok = True
+        for db in self.dbs.values():
+            if db.record(table, id) is None:
+                ok = db.add_customer(id, name, contacts, notes) and ok
+        return ok
+    def checkin(self, nr, customer_id=None):
+        return self.db_for_nr(nr).checkin(nr, customer_id)
+    def checkout(self, nr, customer_id, due=None):
+        return self.db_for_nr(nr).checkout(nr, customer_id, due)
+    def checkin_many(self, nrs, customer_id=None):
+        nrs = list(nrs)
+        return self.db_for_batch(nrs).checkin_many(nrs, customer_id)
+    def checkout_many(self, nrs, customer_id, due=None):
+        nrs = list(nrs)
+        return self.db_for_batch(nrs).checkout_many(nrs, customer_id, due)
+    def record(self, table, key, location=None):
+        """Fetch one row by primary key.
+
+        Items are looked up in their depot and customers in any, as
+        every depot has them; other tables' keys are only unique
+        within a depot, so they need its location.
+
+        :return: column name -> value, None if there's no such row
+        :rtype: dict
+        """
+        if table == self.md.items.table:
+            return self.db_for_nr(key).record(table, key)
+        if location is None:
+            if table != self.md.customers.table:
+                raise ShardRoutingError(f"{table} records need a depot location")
+            location = self.shards[0].location
+        return self.db_for_location(location).record(table, key)
+    def search_SKUs(self, pattern):
+        """Search SKU names in all depots.
+
+        :return: (sku, name, notes) tuples ordered by SKU, each SKU once
+        :rtype: list
+        """
+        merged = {}
+        for _location, found in self._fan_out('search_SKUs', pattern):
+            for row in found:
+                merged.setdefault(row[0], row)
+        return [merged[sku] for sku in sorted(merged)]
+    def available_items(self, SKU):
+        """Find items of an SKU available in any depot.
+
+        :return: (location, inv_nr) tuples ordered by inventory number
+        :rtype: list
+        """
+        merged = []
+        for location, available in self._fan_out('available_items', SKU):
+            merged.extend((location, nr) for nr in available)
+        merged.sort(key=lambda pair: pair[1])
+        return merged
+    def inventory_numbers(self):
+        return set().union(*(nrs for _location, nrs in self._fan_out('inventory_numbers')))
+    def depot_inventory_numbers(self):
+        """Inventory numbers stored in each depot, e.g. to find duplicates.
+
+        :return: sets in shard order
+        :rtype: list
+        """
+        return [nrs for _location, nrs in self._fan_out('inventory_numbers')]
+    def out_inventory_numbers(self):
+        return set().union(*(nrs for _location, nrs in self._fan_out('out_inventory_numbers')))
+    def customer_summaries(self):
+        """Per-customer rental counts summed over all depots.
+
+        :return: (id, name, items_out, lifetime_rentals, overdue) tuples ordered by name
+        :rtype: list
+        """
+        merged = {}
+        for _location, rows in self._fan_out('customer_summaries'):
+            for id, name, items_out, rentals, overdue in rows:
+                counts = merged.get(id)
+                if counts is None:
+                    merged[id] = [id, name, items_out, rentals, overdue]
+                else:
+                    counts[2] += items_out
+                    counts[3] += rentals
+                    counts[4] += overdue
+        return sorted((tuple(row) for row in merged.values()), key=lambda row: (row[1], row[0]))
+    def items_out(self, customer_id):
+        """Items currently rented to a customer, from any depot.
+
+        :return: (inv_nr, sku name, checkout time, due) tuples, oldest first
+        :rtype: list
+        """
+        merged = []
+        for _location, rows in self._fan_out('items_out', customer_id):
+            merged.extend(rows)
+        merged.sort(key=lambda row: row[2])
+        return merged
+    def history(self, table, after_ids=None):
+        """Fetch checkin or checkout records of all depots.
+
+        Record ids are only unique within a depot, hence the location
+        in each record and the last id known per depot.
+
+        :param table: 'checkin' or 'checkout'
+        :type table: str
+        :param after_ids: location -> last id already known; missing
+        locations get their full history
+        :type after_ids: dict, optional
+        :return: (location, id, time, inv_nr, customer_id) tuples ordered by time
+        :rtype: list
+        """
+        after_ids = after_ids or {}
+        futures = [
+            (s.location, self.workers[s.location].submit(
+                self._call_worker_db, s, 'history', (table, after_ids.get(s.location, 0))))
+            for s in self.shards
+        ]
+        merged = []
+        for location, future in futures:
+            merged.extend((location,) + row for row in future.result())
+        merged.sort(key=lambda row: row[2])
+        return merged
+    def _fan_out(self, method, *args):
+        """Call an InventoryDB method on every shard in parallel.
+
+        :return: (location, result) pairs in shard order
+        :rtype: list
+        """
+        futures = [
+            (s.location, self.workers[s.location].submit(self._call_worker_db, s, method, args))
+            for s in self.shards
+        ]
+        return [(location, future.result()) for location, future in futures]
+    def _conn_name(self, location, role):
+        return f"{self.prefix}:{location}:{role}"
+    def _call_worker_db(self, shard, method, args):
+        """Runs inside a shard's worker thread, opening its connection lazily."""
+        db = self.worker_dbs.get(shard.location)
+        if db is None:
+            conn_name = open_db(shard.filepath, self._conn_name(shard.location, 'worker'))
+            if conn_name == '':
+                raise OSError(f"open_db({shard.filepath}) failed in worker thread")
+            db = self.worker_dbs[shard.location] = InventoryDB(conn_name)
+        return getattr(db, method)(*args)
+    def _close_worker_db(self, location):
+        conn_name = self._conn_name(location, 'worker')
+        self.worker_dbs.pop(location, None)
+        if QSqlDatabase.contains(conn_name):
+            QSqlDatabase.database(conn_name).close()
+            QSqlDatabase.removeDatabase(conn_name)
+
+def open_shards(spec) -> ShardedInventoryDB:
+    """Build a ShardedInventoryDB from a plain description.
+
+    :param spec: location -> (filepath, first inv_nr, last inv_nr)
+    :type spec: dict
+    :rtype: ShardedInventoryDB
+    """
+    return ShardedInventoryDB([
+        Shard(location, filepath, range(first, last + 1))
+        for location, (filepath, first, last) in spec.items()
+    ])
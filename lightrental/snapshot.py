@@ -0,0 +1,299 @@
+"""
+LightRental read-only snapshots.
+
+A snapshot is a single binary file holding the inventory, SKUs,
+categories and the merged checkin/checkout history as fixed-width
+NumPy columns. Text is stored once in a string table and referenced
+by id, and sort orders needed for lookups are precomputed at export.
+
+The reader memory-maps the file and hands out views into the mapping,
+so reports and kiosk catalog displays never copy the columns and any
+number of processes share one copy in the page cache - without
+touching, let alone locking, the live SQLite file.
+
+Layout: MAGIC, header length (uint64 LE), JSON header describing each
+array (dtype, shape, offset), then the arrays, each aligned to ALIGN bytes.
+"""
+
+import os
+import json
+import struct
+from bisect import bisect_left
+from datetime import datetime
+import numpy as np
+from PyQt5.QtSql import QSqlQuery
+
+MAGIC = b'LRSNAP01'
+ALIGN = 64
+NO_STRING = -1 # string id of NULL
+
+class SnapshotFormatError(ValueError):
+    """Raised when a file isn't a snapshot this version can read."""
+
+class StringTable:
+    """Deduplicating builder of the snapshot's string table."""
+    def __init__(self) -> None:
+        self.ids = {}
+        self.encoded = []
+    def add(self, text) -> int:
+        if text is None:
+            return NO_STRING
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = len(self.encoded)
+            self.ids[text] = string_id
+            self.encoded.append(text.encode('utf-8'))
+        return string_id
+    def add_all(self, texts):
+        return np.fromiter((self.add(t) for t in texts), dtype=np.int32)
+    def arrays(self):
+        lengths = np.fromiter((len(b) for b in self.encoded), dtype=np.int64, count=len(self.encoded))
+        offsets = np.zeros(len(self.encoded) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        data = np.frombuffer(b''.join(self.encoded), dtype=np.uint8)
+        return offsets, data
+
+def export_snapshot(db, filepath):
+    """Write a snapshot of a database.
+
+    :param db: database to export
+    :type db: InventoryDB
+    :param filepath: snapshot file to (over)write
+    :type filepath: path
+    :return: number of items and history records exported
+    :rtype: tuple
+    """
+    handle = db.connection_handle()
+    # one read transaction, so all tables come from the same state
+    handle.transaction()
+    try:
+        inventory = _read_columns(handle,
+            "SELECT inv_nr, sku, category, notes, img_path FROM inventory ORDER BY sku, inv_nr", 5)
+        skus = _read_columns(handle, "SELECT sku, name, notes FROM skus ORDER BY sku", 3)
+        categories = _read_columns(handle, "SELECT id, name, notes FROM categories ORDER BY id", 3)
+        history = _read_columns(handle,
+            "SELECT id, time, inv_nr, customer_id, 1 FROM checkout_history "
+            "UNION ALL "
+            "SELECT id, time, inv_nr, customer_id, 0 FROM checkin_history "
+            "ORDER BY 2, 5 DESC, 1", 5)
+    finally:
+        handle.rollback()
+    write_snapshot(filepath, inventory, skus, categories, history)
+    return len(inventory[0]), len(history[0])
+
+def write_snapshot(filepath, inventory, skus, categories, history):
+    """Build the columns and indexes from table contents and write them.
+
+    The snapshot is written to a temporary file next to filepath and
+    then renamed over it, so readers that have the old snapshot mapped
+    keep reading it rather than a file truncated under them.
+
+    :param inventory: inv_nr, sku, category, notes, img_path columns, ordered by (sku, inv_nr)
+    :param skus: sku, name, notes columns, ordered by sku
+    :param categories: id, name, notes columns, ordered by id
+    :param history: id, time, inv_nr, customer_id, is_out columns, ordered by time
+    :type inventory, skus, categories, history: lists of equally long lists
+    """
+    strings = StringTable()
+    arrays = {}
+    inv_nr = np.array(inventory[0], dtype=np.int64)
+    arrays['inventory.inv_nr'] = inv_nr
+    arrays['inventory.sku'] = np.array(inventory[1], dtype=np.int64)
+    arrays['inventory.category'] = np.array(inventory[2], dtype=np.int64)
+    arrays['inventory.notes'] = strings.add_all(inventory[3])
+    arrays['inventory.img_path'] = strings.add_all(inventory[4])
+    by_inv_nr = np.argsort(inv_nr, kind='stable')
+    arrays['inventory.by_inv_nr'] = by_inv_nr
+    arrays['inventory.inv_nr_sorted'] = inv_nr[by_inv_nr]
+    arrays['skus.sku'] = np.array(skus[0], dtype=np.int64)
+    arrays['skus.name'] = strings.add_all(skus[1])
+    arrays['skus.notes'] = strings.add_all(skus[2])
+    arrays['skus.by_name'] = np.array(
+        sorted(range(len(skus[0])), key=lambda i: (skus[1][i] or '').casefold()),
+        dtype=np.int64
+    )
+    arrays['categories.id'] = np.array(categories[0], dtype=np.int64)
+    arrays['categories.name'] = strings.add_all(categories[1])
+    arrays['categories.notes'] = strings.add_all(categories[2])
+    arrays['history.id'] = np.array(history[0], dtype=np.int64)
+    arrays['history.time'] = np.array(history[1], dtype='datetime64[s]').astype(np.int64)
+    hist_inv_nr = np.array(history[2], dtype=np.int64)
+    arrays['history.inv_nr'] = hist_inv_nr
+    arrays['history.customer_id'] = np.array(history[3], dtype=np.int64)
+    arrays['history.is_out'] = np.array(history[4], dtype=np.uint8)
+    by_item = np.argsort(hist_inv_nr, kind='stable') # stable keeps time order per item
+    arrays['history.by_inv_nr'] = by_item
+    arrays['history.inv_nr_sorted'] = hist_inv_nr[by_item]
+    arrays['strings.offsets'], arrays['strings.data'] = strings.arrays()
+
+    header = {'created': datetime.now().isoformat(timespec='seconds'), 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        }
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    tmp_path = f"{filepath}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file.
+
+    Columns are exposed as NumPy views into the mapping, e.g.
+    snapshot['inventory.sku']; nothing is loaded until touched.
+    """
+    def __init__(self, filepath) -> None:
+        self.mm = np.memmap(filepath, dtype=np.uint8, mode='r')
+        if bytes(self.mm[:len(MAGIC)]) != MAGIC:
+            raise SnapshotFormatError(f"{filepath} is not a LightRental snapshot")
+        header_len = struct.unpack('<Q', bytes(self.mm[len(MAGIC):len(MAGIC) + 8]))[0]
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(bytes(self.mm[header_start:header_start + header_len]))
+        data_start = _align(header_start + header_len)
+        self.columns = {}
+        for name, desc in self.header['arrays'].items():
+            dtype = np.dtype(desc['dtype'])
+            count = int(np.prod(desc['shape'], dtype=np.int64))
+            start = data_start + desc['offset']
+            self.columns[name] = self.mm[start:start + count * dtype.itemsize].view(dtype).reshape(desc['shape'])
+        self.string_offsets = self.columns['strings.offsets']
+        self.string_data = self.columns['strings.data']
+    def __getitem__(self, name):
+        return self.columns[name]
+    def string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+        return bytes(self.string_data[start:end]).decode('utf-8')
+    def strings(self, string_ids):
+        return [self.string(i) for i in string_ids]
+    def item_rows(self, inv_nrs):
+        """Map inventory numbers to row positions, -1 where unknown."""
+        sorted_nrs = self.columns['inventory.inv_nr_sorted']
+        inv_nrs = np.asarray(inv_nrs, dtype=np.int64)
+        if len(sorted_nrs) == 0:
+            return np.full(inv_nrs.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(sorted_nrs, inv_nrs)
+        pos_clipped = np.minimum(pos, len(sorted_nrs) - 1)
+        found = (pos < len(sorted_nrs)) & (sorted_nrs[pos_clipped] == inv_nrs)
+        return np.where(found, self.columns['inventory.by_inv_nr'][pos_clipped], -1)
+    def item(self, inv_nr):
+        """Look up one item.
+
+        :return: inv_nr, sku, category, notes, img_path; None if unknown
+        :rtype: dict
+        """
+        row = self.item_rows([inv_nr])[0]
+        if row < 0:
+            return None
+        return {
+            'inv_nr': int(self.columns['inventory.inv_nr'][row]),
+            'sku': int(self.columns['inventory.sku'][row]),
+            'category': int(self.columns['inventory.category'][row]),
+            'notes': self.string(self.columns['inventory.notes'][row]),
+            'img_path': self.string(self.columns['inventory.img_path'][row]),
+        }
+    def items_of_SKU(self, sku):
+        """Inventory numbers of an SKU - a slice, as items are stored grouped by SKU."""
+        skus = self.columns['inventory.sku']
+        lo, hi = np.searchsorted(skus, sku, 'left'), np.searchsorted(skus, sku, 'right')
+        return self.columns['inventory.inv_nr'][lo:hi]
+    def items_in_category(self, category):
+        return self.columns['inventory.inv_nr'][self.columns['inventory.category'] == category]
+    def SKUs_by_name(self, prefix=''):
+        """SKU rows in name order, optionally only names starting with a prefix.
+
+        :return: row positions into the skus.* columns
+        :rtype: numpy.ndarray
+        """
+        order = self.columns['skus.by_name']
+        if not prefix:
+            return order
+        names = _SortedNames(self, order)
+        key = prefix.casefold()
+        lo = bisect_left(names, key)
+        hi = lo
+        while hi < len(order) and names[hi].startswith(key):
+            hi += 1
+        return order[lo:hi]
+    def item_history(self, inv_nr):
+        """History rows of an item, oldest first."""
+        sorted_nrs = self.columns['history.inv_nr_sorted']
+        lo = np.searchsorted(sorted_nrs, inv_nr, 'left')
+        hi = np.searchsorted(sorted_nrs, inv_nr, 'right')
+        return self.columns['history.by_inv_nr'][lo:hi]
+    def history_between(self, start, end):
+        """Slice of history rows in [start, end), history being stored by time.
+
+        :type start, end: datetime or ISO string
+        """
+        times = self.columns['history.time']
+        lo = np.searchsorted(times, _epoch(start), 'left')
+        hi = np.searchsorted(times, _epoch(end), 'left')
+        return slice(lo, hi)
+    def checkouts_per_SKU(self, start, end):
+        """Count checkouts of each SKU within a time range.
+
+        :return: SKUs and their checkout counts
+        :rtype: tuple of numpy.ndarray
+        """
+        rows = self.history_between(start, end)
+        out = self.columns['history.is_out'][rows] == 1
+        item_rows = self.item_rows(self.columns['history.inv_nr'][rows][out])
+        skus = self.columns['inventory.sku'][item_rows[item_rows >= 0]]
+        return np.unique(skus, return_counts=True)
+    def close(self):
+        """Drop the views; the mapping goes away with the last one."""
+        self.columns = {}
+        self.string_offsets = self.string_data = None
+        self.mm = None
+
+class _SortedNames:
+    """Sequence of casefolded SKU names in name order, decoded on access for bisect."""
+    def __init__(self, snapshot, order) -> None:
+        self.snapshot = snapshot
+        self.order = order
+        self.name_ids = snapshot['skus.name']
+    def __len__(self):
+        return len(self.order)
+    def __getitem__(self, i):
+        return (self.snapshot.string(self.name_ids[self.order[i]]) or '').casefold()
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+def _epoch(when):
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    return np.datetime64(when, 's').astype(np.int64)
+
+def _read_columns(handle, sql, ncols):
+    """Stream a query's result into one list per column."""
+    query = QSqlQuery(handle)
+    query.setForwardOnly(True)
+    query.exec(sql)
+    columns = [[] for _ in range(ncols)]
+    while query.next():
+        for i, column in enumerate(columns):
+            column.append(query.value(i))
+    query.finish()
+    return columns
@@ -0,0 +1,46 @@
+import pytest
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtSql import QSqlDatabase, QSqlQuery
+from lightrental.database import InventoryDB, create_db
+
+@pytest.fixture(scope='session')
+def app():
+    return QCoreApplication.instance() or QCoreApplication([]) # loads the SQL driver plugins
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'inventory.db')
+
+@pytest.fixture
+def db(app, db_path):
+    """An empty inventory with category 1, SKU 1 (item 1) and customer 1."""
+    conn_name = create_db(db_path)
+    assert conn_name
+    db = InventoryDB(conn_name)
+    db.add_category('tools')
+    db.add_SKU(1, 'drill', 1, 1)
+    db.add_customer(None, 'Ann', 'ann@example.com')
+    yield db
+    del db
+    QSqlDatabase.database(conn_name).close()
+    QSqlDatabase.removeDatabase(conn_name)
+
+def execute(db, sql, values=None):
+    """Run a statement on db's connection, failing the test if it fails."""
+    query = QSqlQuery(db.connection_handle())
+    query.prepare(sql)
+    for placeholder, value in (values or {}).items():
+        query.bindValue(placeholder, value)
+    ok = query.exec()
+    error = query.lastError().text()
+    query.finish()
+    return ok, error
+
+def move(db, table, inv_nr, time, customer_id=1):
+    """Record a checkin or checkout at a given time."""
+    ok, error = execute(
+        db,
+        f"INSERT INTO {table} (time, customer_id, inv_nr) VALUES (:time, :customer_id, :inv_nr)",
+        {":time": time, ":customer_id": customer_id, ":inv_nr": inv_nr}
+    )
+    assert ok, error
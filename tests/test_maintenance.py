@@ -0,0 +1,100 @@
+import pytest
+from PyQt5.QtSql import QSqlDatabase, QSqlQuery
+from conftest import execute, move
+from lightrental.database import InventoryDB, open_db
+from lightrental.maintenance import Maintenance
+from lightrental.pricing import Pricing
+
+def count(db, sql):
+    query = QSqlQuery(db.connection_handle())
+    query.exec(sql)
+    value = query.value(0) if query.next() else None
+    query.finish()
+    return value
+
+@pytest.fixture
+def archived(db, db_path):
+    """Two rentals from 2020 moved to the archive, item 1 out again since."""
+    move(db, 'checkout', 1, '2020-03-02 08:00:00')
+    move(db, 'checkin', 1, '2020-03-03 08:00:00')
+    move(db, 'checkout', 1, '2020-03-06 08:00:00')
+    move(db, 'checkin', 1, '2020-03-09 08:00:00')
+    assert Maintenance(db, db_path).archive_step(30) == 4
+    assert db.checkout(1, 1)
+    return db
+
+@pytest.fixture
+def other(app, db_path):
+    """A second connection, opened before anything was archived."""
+    conn_name = open_db(db_path, 'other')
+    assert conn_name
+    db = InventoryDB(conn_name)
+    yield db
+    del db
+    QSqlDatabase.database(conn_name).close()
+    QSqlDatabase.removeDatabase(conn_name)
+
+def test_archive_step_moves_old_records(db, db_path, other):
+    move(db, 'checkout', 1, '2020-03-02 08:00:00')
+    move(db, 'checkin', 1, '2020-03-03 08:00:00')
+    assert db.checkout(1, 1)
+    maintenance = Maintenance(db, db_path)
+    assert maintenance.archive_step(30) == 2 # the recent checkout stays
+    assert maintenance.archive_step(30) == 0
+    assert count(db, "SELECT COUNT(*) FROM main.checkout") == 1
+    assert count(db, "SELECT COUNT(*) FROM main.checkin") == 0
+    assert count(db, "SELECT COUNT(*) FROM archive.checkout") == 1
+    assert [row[0] for row in other.history('checkout')] == [1, 2]
+    assert [row[0] for row in other.history('checkin')] == [1]
+
+def test_archive_step_keeps_checkouts_of_items_out(db, db_path):
+    move(db, 'checkout', 1, '2020-03-02 08:00:00')
+    assert Maintenance(db, db_path).archive_step(30) == 0
+    assert count(db, "SELECT COUNT(*) FROM main.checkout") == 1
+
+def test_archived_rentals_are_billed(archived):
+    pricing = Pricing(archived)
+    assert pricing.set_SKU_rate(1, 10.0)
+    result = pricing.bill('2020-03-01', '2020-04-01')
+    assert result.lines == 2
+    assert result.total == 10 + 30
+
+def test_unarchived_records_cannot_be_deleted(archived):
+    ok, error = execute(archived, "DELETE FROM main.checkout")
+    assert not ok
+    assert count(archived, "SELECT COUNT(*) FROM main.checkout") == 1
+
+def test_history_cannot_be_updated(archived):
+    assert not execute(archived, "UPDATE main.checkout SET time = '2020-01-01 00:00:00'")[0]
+    assert not execute(archived, "UPDATE main.checkout SET customer_id = 2")[0]
+
+def test_archive_log_cannot_be_updated(archived):
+    assert not execute(archived, "UPDATE main.archive_log SET last_id = last_id + 1")[0]
+
+def test_archive_log_rejects_forged_entries(archived):
+    forge = (
+        "INSERT INTO main.archive_log (time, table_name, first_id, last_id, rows, archive) "
+        "VALUES ('2024-01-01 00:00:00', 'checkout', :first, :last, :rows, 'x.db')"
+    )
+    for first, last, rows in [(3, 3, 0), (1, 3, 1), (4, 4, 0), (3, 9, 1)]:
+        values = {":first": first, ":last": last, ":rows": rows}
+        assert not execute(archived, forge, values)[0], (first, last, rows)
+    assert not execute(archived, "DELETE FROM main.checkout")[0]
+
+def test_optimize_with_the_archive_attached(archived, db_path):
+    maintenance = Maintenance(archived, db_path)
+    assert maintenance.optimize() # ANALYZE
+    assert maintenance.optimize() # PRAGMA optimize
+
+def test_vacuum_step_frees_pages(db, db_path):
+    assert execute(db, "CREATE TABLE scratch (data BLOB)")[0]
+    assert execute(db, "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 200) "
+                       "INSERT INTO scratch SELECT randomblob(4000) FROM n")[0]
+    assert execute(db, "DROP TABLE scratch")[0]
+    free = count(db, "PRAGMA freelist_count")
+    assert free > 100
+    maintenance = Maintenance(db, db_path)
+    assert maintenance.vacuum_step(50)
+    assert count(db, "PRAGMA freelist_count") == free - 50
+    assert not maintenance.vacuum_step(free)
+    assert count(db, "PRAGMA freelist_count") == 0
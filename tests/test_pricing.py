@@ -0,0 +1,80 @@
+import pytest
+from PyQt5.QtSql import QSqlQuery
+from conftest import execute, move
+from lightrental.pricing import Pricing
+
+def rent(db, inv_nr, start, end, customer_id=1):
+    move(db, 'checkout', inv_nr, start, customer_id)
+    move(db, 'checkin', inv_nr, end, customer_id)
+
+def lines(db):
+    rows = []
+    query = QSqlQuery(db.connection_handle())
+    query.exec("SELECT checkout_id, days, amount FROM invoice_lines ORDER BY checkout_id")
+    while query.next():
+        rows.append((query.value(0), query.value(1), query.value(2)))
+    return rows
+
+@pytest.fixture
+def pricing(db):
+    pricing = Pricing(db)
+    assert pricing.set_SKU_rate(1, 10.0, weekend_discount=0.5, weekly_discount=0.2)
+    return pricing
+
+def test_weekend_days_are_discounted(db, pricing):
+    # Friday to Monday: Friday, Saturday and Sunday are billed
+    rent(db, 1, '2024-03-01 10:00:00', '2024-03-04 09:00:00')
+    result = pricing.bill('2024-03-01', '2024-04-01')
+    assert result.lines == 1
+    assert lines(db) == [(1, 3, 10 + 5 + 5)]
+
+def test_full_weeks_are_discounted(db, pricing):
+    # Monday to the next week's Wednesday: one full week, then Monday and Tuesday
+    rent(db, 1, '2024-03-04 08:00:00', '2024-03-13 18:00:00')
+    pricing.bill('2024-03-01', '2024-04-01')
+    assert lines(db) == [(1, 9, 7 * 10 * 0.8 + 10 + 10)]
+
+def test_rest_days_across_a_weekend(db, pricing):
+    # Thursday to the next week's Tuesday: one full week, then Thursday, Friday, Saturday, Sunday
+    rent(db, 1, '2024-03-07 08:00:00', '2024-03-18 08:00:00')
+    pricing.bill('2024-03-01', '2024-04-01')
+    assert lines(db) == [(1, 11, 7 * 10 * 0.8 + 10 + 10 + 5 + 5)]
+
+def test_same_day_return_is_one_day(db, pricing):
+    rent(db, 1, '2024-03-05 08:00:00', '2024-03-05 12:00:00')
+    pricing.bill('2024-03-01', '2024-04-01')
+    assert lines(db) == [(1, 1, 10)]
+
+def test_customer_factor(db, pricing):
+    assert pricing.set_customer_factor(1, 0.9)
+    rent(db, 1, '2024-03-05 08:00:00', '2024-03-07 08:00:00') # Tuesday, Wednesday
+    pricing.bill('2024-03-01', '2024-04-01')
+    assert lines(db) == [(1, 2, 18)]
+
+def test_rentals_are_billed_in_their_return_period(db, pricing):
+    rent(db, 1, '2024-02-28 08:00:00', '2024-03-01 08:00:00')
+    assert pricing.bill('2024-02-01', '2024-03-01').lines == 0
+    assert pricing.bill('2024-03-01', '2024-04-01').lines == 1
+
+def test_billing_again_skips_billed_rentals(db, pricing):
+    rent(db, 1, '2024-03-05 08:00:00', '2024-03-06 08:00:00')
+    assert pricing.bill('2024-03-01', '2024-04-01').lines == 1
+    rent(db, 1, '2024-03-10 08:00:00', '2024-03-11 08:00:00')
+    result = pricing.bill('2024-03-01', '2024-04-01')
+    assert (result.invoices, result.lines) == (1, 1)
+    assert [line[0] for line in lines(db)] == [1, 2]
+
+def test_unpriced_skus_are_reported(db, pricing):
+    db.add_SKU(2, 'ladder', 2, 1)
+    rent(db, 2, '2024-03-05 08:00:00', '2024-03-06 08:00:00')
+    result = pricing.bill('2024-03-01', '2024-04-01')
+    assert (result.lines, result.unpriced) == (0, 1)
+
+def test_repeated_checkin_ends_one_rental(db, pricing):
+    # files from before the checkin guard may hold checkins of items not out
+    assert execute(db, "DROP TRIGGER checkin_summary")[0]
+    rent(db, 1, '2024-03-05 08:00:00', '2024-03-06 08:00:00')
+    move(db, 'checkin', 1, '2024-03-08 08:00:00')
+    result = pricing.bill('2024-03-01', '2024-04-01')
+    assert result is not None
+    assert lines(db) == [(1, 1, 10)]